@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Per-request overhead of restretto transports
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Runs the same resource against local keep-alive http server with every
+    available transport and prints mean time per request.
+
+    Usage (with restretto installed, e.g. by pip install -e .):
+
+        python benchmarks/transports.py [requests count]
+"""
+
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import restretto
+from restretto.errors import TransportError
+from restretto.transport import TRANSPORTS
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # send headers and body in one segment, avoiding delayed ack stalls
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    body = b'{"status": "ok"}'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench(transport, base_uri, count):
+    spec = {
+        'title': transport,
+        'baseUri': base_uri,
+        'resources': [{'get': '/json', 'expect': [{'body': 'json', 'property': 'json.status', 'is': 'ok'}]}]
+    }
+    session = restretto.Session(spec, transport=transport)
+    resource = session.resources[0]
+    try:
+        # warm up connection pool
+        session.test(resource)
+        started = time.perf_counter()
+        for _ in range(count):
+            session.test(resource)
+        return (time.perf_counter() - started) / count
+    finally:
+        session.close()
+
+
+def main(count=2000):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_uri = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    print("{} requests per transport".format(count))
+    for name in sorted(TRANSPORTS):
+        try:
+            per_request = bench(name, base_uri, count)
+        except TransportError as error:
+            print("{:>10}: skipped ({})".format(name, error))
+            continue
+        print("{:>10}: {:8.1f} us/request, {:8.0f} requests/s".format(
+            name, per_request * 1e6, 1 / per_request
+        ))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -3,10 +3,38 @@
 """
     restretto - REST resource endpoints testing toolkit
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Subsystems are imported on first access, so command line startup
+    does not pay for requests, yaml and jinja2 unless they are used
 """
 
-from . import assertions
-from . import errors
-from . import utils
-from .rest import Resource, Session
-from .loader import load
+import importlib
+
+__version__ = "1.0.4"
+
+# public name -> (module, attribute or None for module itself)
+_LAZY = {
+    'assertions': ('.assertions', None),
+    'errors': ('.errors', None),
+    'utils': ('.utils', None),
+    'Resource': ('.rest', 'Resource'),
+    'Session': ('.rest', 'Session'),
+    'load': ('.loader', 'load'),
+}
+
+__all__ = sorted(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    (module, attribute) = _LAZY[name]
+    value = importlib.import_module(module, __name__)
+    if attribute:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
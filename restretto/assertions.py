@@ -2,9 +2,12 @@
 # -*- coding: utf-8 -*-
 
 
+import os
+import json
 from fnmatch import fnmatch
-from .utils import json_path
-from .errors import ExpectError
+from functools import lru_cache
+from .utils import json_path, parse_size
+from .errors import ExpectError, ParseError
 
 
 class ResponseTest(object):
@@ -45,6 +48,14 @@ class ResponseTest(object):
             "Length mismatch: got {} intead of expected {}".format(len(item), value)
         )
 
+    def assert_max(self, item, value):
+        limit = parse_size(value)
+        self.expect(item <= limit, "{} exceeds maximum of {}".format(item, limit))
+
+    def assert_min(self, item, value):
+        limit = parse_size(value)
+        self.expect(item >= limit, "{} is below minimum of {}".format(item, limit))
+
     def assert_statements(self, statements, item):
         # assert all conditions are satisfied
         for (cond, value) in statements.items():
@@ -109,6 +120,77 @@ class BodyTest(ResponsePropertyTest):
         self.assert_statements(self.statements, data)
 
 
+class SizeTest(ResponsePropertyTest):
+    """Response size in bytes: `transfer` (as received, maybe compressed) or `body` (decoded)"""
+
+    SIZES = {'transfer': 'transfer_size', 'body': 'body_size'}
+
+    def test(self, response):
+        self.expect(self.name in self.SIZES, "Unknown size: {}".format(self.name))
+        size = getattr(response, self.SIZES[self.name], None)
+        self.expect(size is not None, "Size not measured: {}".format(self.name))
+        self.assert_statements(self.statements, size)
+
+
+class CachedTest(ResponseTest):
+    """Whether response was served by client side cache (see `cache` session option)"""
+
+    def __init__(self, expected):
+        self.expected = bool(expected)
+
+    def test(self, response):
+        cached = getattr(response, 'cached', False)
+        self.expect(
+            cached == self.expected,
+            "Response was {}served from cache".format('' if cached else 'not ')
+        )
+
+
+@lru_cache(maxsize=None)
+def _compile_schema(path, mtime):
+    try:
+        from jsonschema.validators import validator_for
+    except ImportError:
+        raise ParseError('schema assertion requires jsonschema to be installed')
+    with open(path) as source:
+        if os.path.splitext(path)[1] in ('.yml', '.yaml'):
+            import yaml
+            schema = yaml.full_load(source)
+        else:
+            schema = json.load(source)
+    validator = validator_for(schema)
+    validator.check_schema(schema)
+    return validator(schema)
+
+
+def compile_schema(path):
+    """Return validator for schema file, compiled once per file version"""
+    path = os.path.abspath(path)
+    return _compile_schema(path, os.path.getmtime(path))
+
+
+class SchemaTest(ResponseTest):
+    """Validate json body against JSON Schema file"""
+
+    # errors to report, there may be plenty of them
+    MAX_ERRORS = 5
+
+    def __init__(self, path):
+        self.path = path
+        self.validator = compile_schema(path)
+
+    def test(self, response):
+        try:
+            data = response.json()
+        except ValueError:
+            raise ExpectError("Body is not json, can't validate against {}".format(self.path))
+        errors = sorted(self.validator.iter_errors(data), key=lambda e: list(map(str, e.absolute_path)))
+        self.expect(not errors, "Schema mismatch ({}): {}".format(self.path, "; ".join(
+            "{}: {}".format("/".join(map(str, e.absolute_path)) or "<root>", e.message)
+            for e in errors[:self.MAX_ERRORS]
+        )))
+
+
 class Assert(object):
 
     def __init__(self, statements=[]):
@@ -139,3 +221,12 @@ class Assert(object):
             return HeaderTest(spec.pop('header'), spec)
         if 'body' in spec:
             return BodyTest(spec.pop('body'), spec)
+        if 'size' in spec:
+            return SizeTest(spec.pop('size'), spec)
+        if 'schema' in spec:
+            return SchemaTest(spec['schema'])
+        if 'cached' in spec:
+            return CachedTest(spec['cached'])
+        if 'snapshot' in spec:
+            from .snapshot import SnapshotTest
+            return SnapshotTest(spec['snapshot'], spec.get('ignore'))
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+    Client side HTTP cache for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Opt-in cache layer in front of session transport, enabled with
+    session `cache: true` or --http-cache option. Responses of GET and
+    HEAD requests carrying validators (ETag, Last-Modified) or freshness
+    (Cache-Control max-age) are kept in memory for the session lifetime:
+
+    * fresh responses are served without sending request at all
+    * stale ones are revalidated with If-None-Match/If-Modified-Since
+
+    Not modified response keeps its 304 status, but gets stored headers
+    and body, so both `status: 304` and body assertions can be used.
+    Every response tells whether it came from cache and how many bytes
+    of transfer it has saved
+"""
+
+import time
+import threading
+
+from .transport import Headers, Response, with_params
+
+
+CACHEABLE_METHODS = ('GET', 'HEAD')
+
+
+def cache_control(headers):
+    """Return {directive: value} parsed from Cache-Control header"""
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        (name, _, value) = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def max_age(headers):
+    """Seconds response stays fresh, taking Age header into account"""
+    try:
+        age = int(cache_control(headers).get('max-age') or 0)
+        return age - int(headers.get('Age') or 0)
+    except ValueError:
+        return 0
+
+
+class Entry(object):
+    """Stored response with its validators"""
+
+    def __init__(self, response, vary):
+        self.response = response
+        # request header values response varies by
+        self.vary = vary
+        self.stored = time.monotonic()
+        self.expires = self.stored + max_age(response.headers)
+
+    @property
+    def size(self):
+        """Bytes it took to receive response"""
+        if self.response.transfer_size is not None:
+            return self.response.transfer_size
+        return self.response.body_size
+
+    def matches(self, headers):
+        return all(headers.get(name) == value for (name, value) in self.vary.items())
+
+    def fresh(self, headers):
+        if 'no-cache' in cache_control(headers) or 'no-cache' in cache_control(self.response.headers):
+            return False
+        return time.monotonic() < self.expires
+
+    def validators(self):
+        """Conditional request headers"""
+        headers = {}
+        if 'ETag' in self.response.headers:
+            headers['If-None-Match'] = self.response.headers['ETag']
+        if 'Last-Modified' in self.response.headers:
+            headers['If-Modified-Since'] = self.response.headers['Last-Modified']
+        return headers
+
+    def revalidate(self, response):
+        """Merge not modified response headers into stored ones"""
+        stored = self.response
+        headers = Headers(stored.headers)
+        headers.update(response.headers)
+        for name in ('Content-Length', 'Content-Encoding', 'Transfer-Encoding'):
+            if name in stored.headers:
+                headers[name] = stored.headers[name]
+        self.response = Response(
+            stored.status_code, stored.reason, headers.items(), stored.content,
+            stored.url, stored.transfer_size, stored.request
+        )
+        self.stored = time.monotonic()
+        self.expires = self.stored + max_age(headers)
+
+
+def from_cache(entry, status_code=None, reason=None, response=None):
+    """Response built from cache entry, replacing status of revalidated one"""
+    stored = entry.response
+    cached = Response(
+        status_code or stored.status_code, reason or stored.reason, stored.headers.items(),
+        stored.content, stored.url, response.transfer_size if response else 0,
+        response.request if response else None
+    )
+    if response is not None:
+        cached.started = response.started
+        cached.timings = response.timings
+    cached.cached = True
+    cached.saved = max(0, entry.size - (cached.transfer_size or 0))
+    return cached
+
+
+class CachingTransport(object):
+    """Transport wrapper keeping responses in client side cache"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        # (method, url) -> Entry
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.transport.name
+
+    @property
+    def headers(self):
+        return self.transport.headers
+
+    def update_headers(self, headers):
+        self.transport.update_headers(headers)
+
+    def fork(self):
+        """Forked transport gets own, empty cache"""
+        return CachingTransport(self.transport.fork())
+
+    def set_pool_size(self, size):
+        self.transport.set_pool_size(size)
+
+    def cancel(self):
+        self.transport.cancel()
+
+    def request(self, method, url, params=None, headers=None, data=None, json=None,
+                files=None, timeout=None, max_body=None):
+        method = method.upper()
+        if method not in CACHEABLE_METHODS or data is not None or json is not None or files:
+            return self.transport.request(
+                method, url, params=params, headers=headers, data=data, json=json,
+                files=files, timeout=timeout, max_body=max_body
+            )
+        key = (method, with_params(url, params))
+        request_headers = Headers(self.transport.headers)
+        request_headers.update(headers or {})
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and not entry.matches(request_headers):
+            entry = None
+        if entry is not None and entry.fresh(request_headers):
+            return from_cache(entry)
+        conditional = Headers(headers)
+        if entry is not None:
+            for (name, value) in entry.validators().items():
+                conditional.setdefault(name, value)
+        response = self.transport.request(
+            method, url, params=params, headers=dict(conditional),
+            timeout=timeout, max_body=max_body
+        )
+        if entry is not None and response.status_code == 304:
+            with self.lock:
+                entry.revalidate(response)
+            return from_cache(entry, response.status_code, response.reason, response)
+        self.store(key, request_headers, response)
+        return response
+
+    def store(self, key, request_headers, response):
+        """Keep successful response, when it can be reused"""
+        if response.status_code != 200:
+            return
+        if 'no-store' in cache_control(request_headers) or 'no-store' in cache_control(response.headers):
+            return
+        names = [n.strip() for n in response.headers.get('Vary', '').split(',') if n.strip()]
+        if '*' in names:
+            return
+        headers = response.headers
+        if not ('ETag' in headers or 'Last-Modified' in headers or max_age(headers) > 0):
+            return
+        vary = {name: request_headers.get(name) for name in names}
+        with self.lock:
+            self.entries[key] = Entry(response, vary)
+
+    def close(self):
+        with self.lock:
+            self.entries.clear()
+        self.transport.close()
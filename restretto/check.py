@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+    Static suite validation for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Loads all test files and reports problems usually found only when
+    resource is reached during the run: malformed requests, unknown
+    assertions and operators, missing schema and upload files and
+    template variables defined nowhere. Variables are resolved against
+    command line vars, session vars (including var files), vars shared
+    by suite setup fixtures and vars extracted by earlier resources of
+    the same session. No requests are sent
+"""
+
+import os
+from functools import lru_cache
+
+from . import assertions
+from .errors import ParseError
+from .loader import find_files, load_spec
+from .rest import Resource, HTTP_METHODS
+from .utils import parse_size
+
+
+RESOURCE_KEYS = frozenset((
+    'url', 'method', 'headers', 'params', 'data', 'json', 'files', 'title', 'name',
+    'vars', 'expect', 'assert', 'download', 'timeout', 'max_body'
+)) | HTTP_METHODS
+
+SESSION_KEYS = frozenset((
+    'title', 'name', 'session', 'filename', 'vars', 'var_files', 'baseUri', 'headers', 'verify',
+    'timeout', 'max_body', 'cache', 'resources', 'setup', 'teardown'
+))
+
+# roots of data resource vars are extracted from, see Resource.test
+VAR_ROOTS = ('json', 'headers')
+
+BODY_KINDS = ('text', 'json')
+
+
+class Problem(object):
+    """Single problem found in test file"""
+
+    def __init__(self, filename, location, message):
+        self.filename = filename
+        self.location = location
+        self.message = message
+
+    def __str__(self):
+        return '{}: {}: {}'.format(self.filename, self.location, self.message)
+
+
+@lru_cache(maxsize=1)
+def environment():
+    from jinja2 import Environment
+    return Environment()
+
+
+def templates(value):
+    """Yield template strings found in value, the ones apply_context renders"""
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from templates(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from templates(item)
+    elif isinstance(value, str) and "{{" in value:
+        yield value
+
+
+def template_vars(source):
+    """Return names of variables used by template, raises ParseError on bad syntax"""
+    from jinja2 import TemplateSyntaxError, meta
+    env = environment()
+    try:
+        names = meta.find_undeclared_variables(env.parse(source))
+    except TemplateSyntaxError as error:
+        raise ParseError('Bad template {!r}: {}'.format(source, error.message))
+    return set(names) - set(env.globals)
+
+
+def operators(statements):
+    """Return unknown assertion operators"""
+    return sorted(
+        key for key in statements
+        if not hasattr(assertions.ResponseTest, 'assert_{}'.format(key))
+    )
+
+
+def check_assertion(spec):
+    """Return messages on problems of single assertion statement"""
+    if not isinstance(spec, dict):
+        return ['Assertion should be a mapping: {!r}'.format(spec)]
+    spec = dict(spec)
+    if 'status' in spec:
+        return []
+    if 'header' in spec:
+        spec.pop('header')
+        return ['Unknown operator: {}'.format(op) for op in operators(spec)]
+    if 'body' in spec:
+        problems = []
+        kind = spec.pop('body')
+        spec.pop('property', None)
+        if kind not in BODY_KINDS:
+            problems.append('Unknown body kind: {} (should be one of {})'.format(kind, ', '.join(BODY_KINDS)))
+        return problems + ['Unknown operator: {}'.format(op) for op in operators(spec)]
+    if 'size' in spec:
+        problems = []
+        kind = spec.pop('size')
+        if kind not in assertions.SizeTest.SIZES:
+            problems.append('Unknown size: {} (should be one of {})'.format(
+                kind, ', '.join(sorted(assertions.SizeTest.SIZES))
+            ))
+        for (op, value) in spec.items():
+            if op in ('max', 'min'):
+                try:
+                    parse_size(value)
+                except ValueError as error:
+                    problems.append(str(error))
+        return problems + ['Unknown operator: {}'.format(op) for op in operators(spec)]
+    if 'schema' in spec:
+        path = spec['schema']
+        if '{{' in str(path):
+            return []
+        if not os.path.exists(path):
+            return ['Schema file not found: {}'.format(path)]
+        try:
+            assertions.compile_schema(path)
+        except Exception as error:
+            return ['Bad schema {}: {}'.format(path, error)]
+        return []
+    if 'cached' in spec:
+        return []
+    if 'snapshot' in spec:
+        from . import snapshot
+        name = spec.pop('snapshot')
+        ignore = spec.pop('ignore', None)
+        problems = ['Unknown snapshot option: {}'.format(key) for key in sorted(spec, key=str)]
+        if ignore is not None and not isinstance(ignore, (str, list)):
+            problems.append('Snapshot ignore should be a list of paths')
+        path = snapshot.snapshot_path(name)
+        if not snapshot.UPDATE and '{{' not in str(name) and not os.path.exists(path):
+            problems.append('Snapshot not recorded: {}'.format(path))
+        return problems
+    return ['Unknown assertion: {}'.format(', '.join(sorted(map(str, spec))))]
+
+
+def upload_paths(files):
+    if isinstance(files, str):
+        return [files]
+    if isinstance(files, list):
+        return [f for item in files for f in upload_paths(item)]
+    if isinstance(files, dict):
+        return upload_paths(list(files.values()))
+    return []
+
+
+class Checker(object):
+    """Validate test files, collecting problems"""
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.problems = []
+        self.files = 0
+
+    def report(self, filename, location, message):
+        self.problems.append(Problem(filename, location, message))
+
+    def undefined(self, filename, location, value, defined):
+        names = set()
+        for source in templates(value):
+            try:
+                names |= template_vars(source)
+            except ParseError as error:
+                self.report(filename, location, str(error))
+        for name in sorted(names - defined):
+            self.report(filename, location, 'Undefined variable: {}'.format(name))
+
+    def check_resources(self, spec, section, entries, defined):
+        """Check resources in order, returns defined vars extended by extracted ones"""
+        filename = spec.get('filename')
+        if entries is None:
+            return defined
+        if not isinstance(entries, list):
+            self.report(filename, section, 'Resources should be a list')
+            return defined
+        for (n, item) in enumerate(entries, 1):
+            location = '{}[{}]'.format(section, n)
+            if isinstance(item, dict) and 'wait' in item:
+                try:
+                    int(item['wait'])
+                except (TypeError, ValueError):
+                    self.report(filename, location, 'Bad wait delay: {!r}'.format(item['wait']))
+                continue
+            if not isinstance(item, (dict, str)):
+                self.report(filename, location, 'Resource should be a mapping or url')
+                continue
+            try:
+                resource = Resource(item)
+            except (ParseError, ValueError) as error:
+                self.report(filename, location, str(error) or 'Bad resource')
+                continue
+            location = '{} ({})'.format(location, resource.title)
+            for key in sorted(set(resource.spec) - RESOURCE_KEYS, key=str):
+                self.report(filename, location, 'Unknown resource key: {}'.format(key))
+            self.undefined(filename, location, [resource.request, resource.asserts], defined)
+            asserts = resource.asserts or []
+            if not isinstance(asserts, list):
+                self.report(filename, location, 'Assertions should be a list')
+                asserts = []
+            for statement in asserts:
+                for message in check_assertion(statement):
+                    self.report(filename, location, message)
+            for path in upload_paths(resource.request.get('files')):
+                if '{{' not in path and not os.path.exists(path):
+                    self.report(filename, location, 'Upload file not found: {}'.format(path))
+            extracted = resource.spec.get('vars') or {}
+            if not isinstance(extracted, dict):
+                self.report(filename, location, 'Vars should be a mapping of name: path')
+                continue
+            for (name, path) in extracted.items():
+                if str(path).split('.')[0] not in VAR_ROOTS:
+                    self.report(filename, location, 'Var {} path should start with {}'.format(
+                        name, ' or '.join(VAR_ROOTS)
+                    ))
+            # extracted vars are available to following resources only
+            defined = defined | set(extracted)
+        return defined
+
+    def setup_vars(self, spec):
+        """Names of vars shared by setup fixtures of the session"""
+        setup = spec.get('setup') or {}
+        if isinstance(setup, list):
+            setup = {'resources': setup}
+        names = set()
+        for item in (setup.get('resources') if isinstance(setup, dict) else None) or []:
+            if isinstance(item, dict) and isinstance(item.get('vars'), dict):
+                names |= set(item['vars'])
+        return names
+
+    def check_spec(self, spec, shared):
+        filename = spec.get('filename')
+        for key in sorted(set(spec) - SESSION_KEYS, key=str):
+            self.report(filename, 'session', 'Unknown session key: {}'.format(key))
+        own = spec.get('vars') or {}
+        if not isinstance(own, dict):
+            self.report(filename, 'vars', 'Vars should be a mapping')
+            own = {}
+        for key in ('timeout', 'max_body'):
+            try:
+                float(spec[key]) if key == 'timeout' else parse_size(spec[key])
+            except KeyError:
+                pass
+            except (TypeError, ValueError):
+                self.report(filename, key, 'Bad {} value: {!r}'.format(key, spec[key]))
+        # session settings are rendered with own and fixture vars only
+        self.undefined(filename, 'session', [spec.get('baseUri'), spec.get('headers')], set(own) | shared)
+        setup = spec.get('setup') or {}
+        if isinstance(setup, dict):
+            setup = setup.get('resources')
+        defined = set(self.context) | set(own)
+        defined = self.check_resources(spec, 'setup', setup, defined) | shared
+        defined = self.check_resources(spec, 'resources', spec.get('resources'), defined)
+        self.check_resources(spec, 'teardown', spec.get('teardown'), defined)
+
+    def check(self, path):
+        """Check all files found at path, returns problems"""
+        specs = []
+        for entry in find_files(path):
+            self.files += 1
+            try:
+                spec = load_spec(entry)
+            except Exception as error:
+                self.report(entry, 'file', 'Can not be loaded: {}'.format(error))
+                continue
+            # files without resources are skipped by loader, like var files
+            if spec and any(spec.get(key) for key in ('resources', 'setup', 'teardown')):
+                specs.append(spec)
+        shared = set()
+        for spec in specs:
+            shared |= self.setup_vars(spec)
+        for spec in specs:
+            self.check_spec(spec, shared)
+        return self.problems
+
+
+def check(path, context=None):
+    """Validate test files at path without sending requests, returns list of problems"""
+    return Checker(context).check(path)
@@ -8,9 +8,24 @@
 
 import sys
 from argparse import ArgumentParser, ArgumentTypeError
-from . import load
-from .errors import ExpectError
-from clint.textui import colored, puts
+from . import __version__
+from .control import Control
+from .runner import Runner, Reporter, MultiReporter, Totals, PASS, FAIL, ERROR, CANCELLED
+from .transport import TRANSPORTS, DEFAULT_TRANSPORT
+from .utils import parse_size
+from .shard import DEFAULT_TIMINGS, load_timings, save_timings, select
+from .history import DEFAULT_HISTORY, MIN_BASELINE
+
+
+class LazyColored(object):
+    """clint.textui.colored, imported on first use"""
+
+    def __getattr__(self, name):
+        from clint.textui import colored as clint_colored
+        return getattr(clint_colored, name)
+
+
+colored = LazyColored()
 
 
 def options(encoded):
@@ -27,10 +42,47 @@ def options(encoded):
     return opts
 
 
-parser = ArgumentParser(description="REST resources/endpoints testing tool")
-parser.add_argument("path", help="path to look for tests (file or directory)")
+def shard(encoded):
+    """Returns (index, total) tuple parsed from string in form i/N"""
+    try:
+        index, total = (int(p) for p in encoded.split("/"))
+        if not 1 <= index <= total:
+            raise ValueError
+    except Exception:
+        raise ArgumentTypeError("shard should be given as i/N with 1 <= i <= N: {}".format(encoded))
+    return (index, total)
+
+
+def address(encoded):
+    """Returns (host, port) tuple parsed from string in form host:port or :port"""
+    try:
+        host, port = encoded.rsplit(":", 1)
+        return (host or "127.0.0.1", int(port))
+    except Exception:
+        raise ArgumentTypeError("address should be given as host:port: {}".format(encoded))
+
+
+def think_time(encoded):
+    """Returns (min, max) seconds tuple parsed from string in form S or MIN-MAX"""
+    try:
+        low, _, high = encoded.partition("-")
+        (low, high) = (float(low), float(high or low))
+        if not 0 <= low <= high:
+            raise ValueError
+    except Exception:
+        raise ArgumentTypeError("think time should be given as SECONDS or MIN-MAX: {}".format(encoded))
+    return (low, high)
+
+
+parser = ArgumentParser(prog="restretto", description="REST resources/endpoints testing tool")
+parser.add_argument("path", nargs="?", help="path to look for tests (file or directory)")
+parser.add_argument("--version", action="version", version="%(prog)s {}".format(__version__))
 #parser.add_argument("--xunit", dest="xunit_dir", default=None,
 #                    help="output xunit reports to this dir")
+parser.add_argument(
+    "--check", action="store_true",
+    help="Validate test files and template variables without sending requests"
+)
 parser.add_argument("--print-passed", action="store_true", help="Print passed tests")
 parser.add_argument("--print-response", action="store_true", help="Print responses")
 parser.add_argument(
@@ -40,47 +92,522 @@ parser.add_argument(
     "--debug-errors", action="store_true",
     help="Open ipdb (should be isntalled) debugger on errors"
 )
+parser.add_argument(
+    "--transport", choices=sorted(TRANSPORTS), default=DEFAULT_TRANSPORT,
+    help="HTTP transport backend (default: {})".format(DEFAULT_TRANSPORT)
+)
+parser.add_argument(
+    "--http-cache", action="store_true",
+    help="Keep responses in client side HTTP cache, revalidating them on repeats"
+)
+parser.add_argument(
+    "--timeout", metavar="SECONDS", type=float, default=None,
+    help="Default request timeout (overridden by session and resource 'timeout')"
+)
+parser.add_argument(
+    "--deadline", metavar="SECONDS", type=float, default=None,
+    help="Cancel remaining tests when the whole run takes longer than SECONDS"
+)
+parser.add_argument(
+    "--max-failures", metavar="N", type=int, default=None,
+    help="Cancel remaining tests after N failures or errors"
+)
+parser.add_argument(
+    "--fail-fast", dest="max_failures", action="store_const", const=1,
+    help="Cancel remaining tests after the first failure or error"
+)
+parser.add_argument(
+    "--shard", metavar="i/N", type=shard, default=None,
+    help="Run only i-th of N shards of sessions balanced by recorded durations"
+    " (all shards of a run need the same timings)"
+)
+parser.add_argument(
+    "--timings", metavar="FILE", default=None,
+    help="Session durations file used for sharding (default: {})".format(DEFAULT_TIMINGS)
+)
+parser.add_argument(
+    "--last-failed", action="store_true",
+    help="Run only sessions failed on the last run (all of them when none failed)"
+)
+parser.add_argument(
+    "--failed-first", action="store_true",
+    help="Run sessions failed on the last run before other ones"
+)
+parser.add_argument(
+    "--changed-only", action="store_true",
+    help="Run only sessions whose files or var files changed since they were last run"
+)
+parser.add_argument(
+    "--results", metavar="FILE", default=None,
+    help="Session results of the last run (default: .restretto-results.json)"
+)
+parser.add_argument(
+    "--update-snapshots", action="store_true",
+    help="Record bodies checked by snapshot assertions instead of comparing them"
+)
+parser.add_argument(
+    "--snapshots", metavar="DIR", default=None,
+    help="Directory snapshots are kept in (default: snapshots)"
+)
+parser.add_argument(
+    "--fixtures-cache", metavar="FILE", default=None,
+    help="Cache of setup fixtures vars with 'ttl' (default: .restretto-fixtures.json)"
+)
+parser.add_argument(
+    "--refresh-fixtures", action="store_true",
+    help="Run setup fixtures even when their vars are cached"
+)
+parser.add_argument(
+    "--history", action="store_true",
+    help="Append resource timings and outcomes to performance history, see `restretto report`"
+)
+parser.add_argument(
+    "--history-file", metavar="FILE", default=None,
+    help="Performance history file (default: {})".format(DEFAULT_HISTORY)
+)
+parser.add_argument(
+    "--har", metavar="FILE", default=None,
+    help="Stream all requests and responses with timings into HAR FILE"
+)
+parser.add_argument(
+    "--har-max-body", metavar="SIZE", type=parse_size, default=None,
+    help="Truncate response bodies saved into HAR to SIZE (0 omits bodies)"
+)
+parser.add_argument(
+    "--coordinator", metavar="HOST:PORT", type=address, default=None,
+    help="Listen on HOST:PORT and hand out sessions to workers (use trusted networks only)"
+)
+parser.add_argument(
+    "--local-workers", metavar="N", type=int, default=0,
+    help="Start N local worker processes for coordinator"
+)
+parser.add_argument(
+    "--worker", metavar="HOST:PORT", type=address, default=None,
+    help="Run sessions handed out by coordinator listening on HOST:PORT"
+)
+parser.add_argument(
+    "--users", metavar="N", type=int, default=None,
+    help="Run sessions as scenario of N concurrent virtual users with isolated state"
+    " (one thread per user, up to a few hundreds)"
+)
+parser.add_argument(
+    "--ramp-up", metavar="SECONDS", type=float, default=0,
+    help="Start virtual users evenly during SECONDS"
+)
+parser.add_argument(
+    "--think-time", metavar="S|MIN-MAX", type=think_time, default=(0, 0),
+    help="Virtual user pause after every resource, fixed or random in range"
+)
+parser.add_argument(
+    "--watch", action="store_true",
+    help="Keep sessions loaded, re-running ones affected by changed test and var files"
+)
+parser.add_argument(
+    "--probe", metavar="SECONDS", type=float, default=None,
+    help="Keep running tests every SECONDS as synthetic probe"
+)
+parser.add_argument(
+    "--probe-count", metavar="N", type=int, default=None,
+    help="Stop probing after N iterations (runs forever by default)"
+)
+parser.add_argument(
+    "--metrics-file", metavar="FILE", default=None,
+    help="Write metrics in OpenMetrics format to FILE (probe, coordinator and users modes)"
+)
+parser.add_argument(
+    "--metrics-port", metavar="PORT", type=int, default=None,
+    help="Serve probe metrics in OpenMetrics format on local PORT"
+)
+
+
+report_parser = ArgumentParser(
+    prog="restretto report",
+    description="Show resource latency trends from performance history, flagging p95 regressions"
+)
+report_parser.add_argument(
+    "--history", metavar="FILE", default=DEFAULT_HISTORY,
+    help="Performance history file (default: {})".format(DEFAULT_HISTORY)
+)
+report_parser.add_argument(
+    "--window", metavar="N", type=int, default=1,
+    help="Compare N most recent runs (default: 1)"
+)
+report_parser.add_argument(
+    "--baseline", metavar="N", type=int, default=5,
+    help="with N runs before them (default: 5)"
+)
+report_parser.add_argument(
+    "--threshold", metavar="PERCENT", type=float, default=20,
+    help="Flag resources whose p95 got worse by more than PERCENT (default: 20)"
+)
+report_parser.add_argument(
+    "--min-baseline", metavar="N", type=int, default=MIN_BASELINE,
+    help="Flag only resources timed in at least N baseline runs (default: {})".format(MIN_BASELINE)
+)
+report_parser.add_argument(
+    "--regressions-only", action="store_true", help="Show regressed resources only"
+)
+
+
+class ConsoleReporter(Reporter):
+    """Print results as they come"""
+
+    def __init__(self, arguments):
+        self.arguments = arguments
+
+    def session_started(self, title):
+        hdr = "Test session: {}".format(title)
+        print(hdr)
+        print('-' * len(hdr))
+
+    def result(self, result):
+        if result.outcome == PASS:
+            if self.arguments.print_passed:
+                # TODO: print response status instead
+                print("{} {}: Ok{}".format(
+                    colored.green("[PASS]"), result.resource,
+                    " (cached, {} bytes saved)".format(result.saved) if result.cached else ""
+                ))
+        elif result.outcome == FAIL:
+            print("{} {}: {}".format(colored.red("[FAIL]"), result.resource, result.message))
+        elif result.outcome == ERROR:
+            print("{} {}: {}".format(colored.yellow("[ERROR]"), result.resource, result.message))
+            # TODO: remove it
+            if self.arguments.debug_errors:
+                import ipdb
+                ipdb.set_trace()
+        elif result.message:
+            # cancelled while running, skipped ones are only counted
+            print("{} {}: {}".format(colored.yellow("[CANCELLED]"), result.resource, result.message))
+        if self.arguments.print_response and result.outcome in (PASS, FAIL) and result.response is not None:
+            print(result.response.text)
+
+    def session_finished(self, title, duration):
+        print("")
+
+
+class ProbeReporter(ConsoleReporter):
+    """Print results without session headers, probe output is continuous"""
+
+    def session_started(self, title):
+        pass
+
+    def session_finished(self, title, duration):
+        pass
+
+
+def probe(sessions, arguments):
+    """Run sessions continuously as synthetic probe"""
+    from .probe import Probe, MetricsServer, write_metrics
+
+    def export(prober):
+        if arguments.metrics_file:
+            write_metrics(arguments.metrics_file, prober.metrics)
+
+    prober = Probe(
+        sessions, arguments.probe, context=arguments.vars,
+        timeout=arguments.timeout, reporter=ProbeReporter(arguments)
+    )
+    server = None
+    if arguments.metrics_port is not None:
+        server = MetricsServer(prober.metrics, ('127.0.0.1', arguments.metrics_port)).start()
+    try:
+        prober.run(arguments.probe_count, on_iteration=export)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.stop()
+    return 0
+
+
+def configure_snapshots(arguments):
+    if arguments.update_snapshots or arguments.snapshots:
+        from . import snapshot
+        snapshot.UPDATE = arguments.update_snapshots
+        snapshot.DIRECTORY = arguments.snapshots or snapshot.DIRECTORY
 
 
 def main(args=sys.argv[1:]):
+    if args[:1] == ["report"]:
+        return report(report_parser.parse_args(args[1:]))
     arguments = parser.parse_args(args)
+    modes = (arguments.worker, arguments.coordinator, arguments.users, arguments.watch, arguments.probe is not None)
+    if arguments.har and any(modes):
+        # HAR pages follow sessions one by one, so only local runs are captured
+        parser.error("--har can not be used with --worker, --coordinator, --users, --watch or --probe")
+    # workers check snapshots of sessions they get, coordinator forwards both options
+    configure_snapshots(arguments)
+    if arguments.worker:
+        from .distributed import Worker
+        Worker(arguments.worker, transport=arguments.transport, cache=arguments.http_cache).run()
+        return 0
+    if not arguments.path:
+        parser.error("path is required")
+    if arguments.check:
+        return check(arguments)
+    if arguments.watch:
+        return watch(arguments)
+    from .loader import load
+    from .fixtures import Fixtures, DEFAULT_CACHE
+    from . import lastrun
 
-    sessions = load(arguments.path)
+    loaded = load(arguments.path, transport=arguments.transport, cache=arguments.http_cache)
+    fixtures = Fixtures(
+        loaded, arguments.fixtures_cache or DEFAULT_CACHE,
+        arguments.refresh_fixtures, arguments.vars
+    )
+    sessions = [s for s in loaded if s.resources]
     if not sessions:
         print("No test sessions found, exiting")
         sys.exit(1)
 
-    passed = failed = errors = 0
-    for test_session in sessions:
-        hdr = "Test session: {}".format(test_session.title)
-        print(hdr)
-        print('-' * len(hdr))
-        for resource in test_session.resources:
-            try:
-                test_session.test(resource, context=arguments.vars)
-                if arguments.print_passed:
-                    # TODO: print response status instead
-                    print("{} {}: Ok".format(colored.green("[PASS]"), resource.title))
-                if arguments.print_response:
-                    print(resource.response.text)
-                passed += 1
-            except ExpectError as failure:
-                print("{} {}: {}".format(colored.red("[FAIL]"), resource.title, failure))
-                if arguments.print_response:
-                    print(resource.response.text)
-                failed += 1
-            except Exception as error:
-                print("{} {}: {}".format(colored.yellow("[ERROR]"), resource.title, error))
-                # TODO: remove it
-                if arguments.debug_errors:
-                    import ipdb
-                    ipdb.set_trace()
-                errors += 1
+    results_file = arguments.results or lastrun.DEFAULT_RESULTS
+    digests = lastrun.digests(sessions)
+    if arguments.last_failed or arguments.changed_only or arguments.failed_first:
+        sessions = lastrun.select(
+            sessions, lastrun.load_results(results_file), digests,
+            arguments.last_failed, arguments.changed_only, arguments.failed_first
+        )
+        if not sessions:
+            print("No failed or changed test sessions, exiting")
+            return 0
+
+    timings = arguments.timings or (DEFAULT_TIMINGS if arguments.shard else None)
+    if arguments.shard:
+        (index, total) = arguments.shard
+        sessions = select(sessions, index, total, load_timings(timings))
+        if not sessions:
+            print("No test sessions in shard {}/{}, exiting".format(index, total))
+            return 0
+
+    control = Control(arguments.deadline, arguments.max_failures)
+    results = lastrun.ResultsReporter(results_file, digests)
+    reporters = [results]
+    history_file = arguments.history_file or (DEFAULT_HISTORY if arguments.history else None)
+    if history_file:
+        from .history import History, HistoryReporter
+        history = HistoryReporter(History(history_file), arguments.path)
+        reporters.append(history)
+    # setup results are added to totals of the run
+    setup = Runner(arguments.vars, arguments.timeout, control, ConsoleReporter(arguments))
+    try:
+        if fixtures.setups:
+            fixtures.setup(setup)
+        if arguments.probe is not None:
+            return probe(sessions, arguments)
+        if arguments.coordinator:
+            return coordinate(sessions, control, timings, arguments, reporters, setup.totals)
+        if arguments.users:
+            return virtual_users(sessions, control, arguments, reporters, setup.totals)
+        return run(sessions, control, timings, arguments, reporters, setup.totals)
+    finally:
+        # results are saved even for interrupted runs
+        results.close()
+        if history_file:
+            history.close()
+            history.history.close()
+        if fixtures.teardowns:
+            # teardown runs even when tests were cancelled, but not past the run deadline
+            fixtures.teardown(Runner(
+                arguments.vars, arguments.timeout, Control(control.remaining), ConsoleReporter(arguments)
+            ))
+        for test_session in loaded:
+            test_session.close()
+
+
+def run(sessions, control, timings, arguments, reporters=(), setup=None):
+    """Run sessions locally"""
+    reporters = [ConsoleReporter(arguments)] + list(reporters)
+    har = None
+    if arguments.har:
+        from .har import HarWriter
+        har = HarWriter(arguments.har, arguments.har_max_body)
+        reporters.append(har)
+    reporter = MultiReporter(*reporters)
+    runner = Runner(arguments.vars, arguments.timeout, control, reporter)
+    try:
+        totals = runner.run(sessions)
+    finally:
+        if har:
+            har.close()
+    if timings:
+        save_timings(timings, runner.durations)
+    return summary(totals, control, setup)
+
+
+def coordinate(sessions, control, timings, arguments, reporters=(), setup=None):
+    """Hand out sessions to workers, report merged results"""
+    import subprocess
+    from .distributed import Coordinator
+    from .probe import write_metrics
+
+    coordinator = Coordinator(
+        sessions, arguments.coordinator, arguments.vars, arguments.timeout,
+        control, MultiReporter(ConsoleReporter(arguments), *reporters)
+    )
+    (host, port) = coordinator.address
+    print("Coordinator listening on {}:{}".format(host, port))
+    print("")
+    workers = [
+        subprocess.Popen([
+            sys.executable, "-m", "restretto", "--worker", "{}:{}".format(host, port),
+            "--transport", arguments.transport
+        ] + (["--http-cache"] if arguments.http_cache else [])
+          + (["--update-snapshots"] if arguments.update_snapshots else [])
+          + (["--snapshots", arguments.snapshots] if arguments.snapshots else []))
+        for _ in range(arguments.local_workers)
+    ]
+    try:
+        totals = coordinator.run()
+    finally:
+        for worker in workers:
+            worker.wait()
+    if timings:
+        save_timings(timings, coordinator.durations)
+    if arguments.metrics_file:
+        write_metrics(arguments.metrics_file, coordinator.metrics)
+    return summary(totals, control, setup)
+
+
+def virtual_users(sessions, control, arguments, reporters=(), setup=None):
+    """Run sessions as concurrent virtual users, report merged results"""
+    from .users import VirtualUsers
+    from .probe import write_metrics
+
+    users = VirtualUsers(
+        sessions, arguments.users, arguments.ramp_up, arguments.think_time,
+        arguments.vars, arguments.timeout, control, MultiReporter(ProbeReporter(arguments), *reporters)
+    )
+    totals = users.run()
+    if arguments.metrics_file:
+        write_metrics(arguments.metrics_file, users.metrics)
+    print("")
+    print("Users: {} / Duration: {:.2f}s / Requests per second: {:.1f}".format(
+        users.started, users.duration, totals.total / users.duration if users.duration else 0
+    ))
+    return summary(totals, control, setup)
+
+
+def watch(arguments):
+    """Run sessions, then re-run ones affected by changed files until interrupted"""
+    from .fixtures import Fixtures, DEFAULT_CACHE
+    from .watch import Watch, watcher
+
+    watched = Watch(arguments.path, arguments.transport, arguments.http_cache)
+    observer = watcher(watched.files, [arguments.path])
+    # vars extracted by setup fixtures, shared with reloaded sessions
+    shared = {}
+    # ids of loaded sessions whose setup passed, their teardown runs on exit
+    ready = set()
+    refresh = arguments.refresh_fixtures
+    sessions = watched.load()
+    try:
+        while True:
+            for (filename, error) in sorted(watched.errors.items()):
+                print("{} {}: {}".format(colored.red("[ERROR]"), filename, error))
+            control = Control(arguments.deadline, arguments.max_failures)
+            runner = Runner(arguments.vars, arguments.timeout, control, ConsoleReporter(arguments))
+            fixtures = Fixtures(sessions, arguments.fixtures_cache or DEFAULT_CACHE, refresh, arguments.vars)
+            fixtures.vars = dict(shared)
+            if fixtures.setup(runner):
+                shared = fixtures.vars
+            ready |= fixtures.ready
+            # setup is run again only for changed sessions, using cached vars
+            refresh = False
+            summary(runner.run([s for s in sessions if s.resources]), control)
+            print("Watching for changes ({}), press Ctrl+C to stop".format(observer.name))
+            sessions = None
+            while sessions is None:
+                sessions = watched.reload(observer.wait())
+            # reloaded sessions run their setup again
+            ready &= {id(s) for s in watched.sessions.values()} - {id(s) for s in sessions}
+            print("")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fixtures = Fixtures(list(watched.sessions.values()))
+        fixtures.ready = ready
+        if fixtures.teardowns:
+            fixtures.teardown(Runner(arguments.vars, arguments.timeout, reporter=ConsoleReporter(arguments)))
+        observer.close()
+        watched.close()
+    return 0
+
+
+def milliseconds(seconds):
+    return "{:.1f}ms".format(seconds * 1000) if seconds is not None else "-"
+
+
+def report(arguments):
+    """Print latency trends, return exit code failing on regressions"""
+    import os
+    from .history import History, trends, sparkline
+
+    if not os.path.exists(arguments.history):
+        print("No performance history found: {} (record runs with --history)".format(arguments.history))
+        return 1
+    history = History(arguments.history)
+    try:
+        runs = history.runs()
+        results = trends(
+            history, arguments.window, arguments.baseline, arguments.threshold / 100, arguments.min_baseline
+        )
+    finally:
+        history.close()
+    regressions = [t for t in results if t.regression]
+    rows = [
+        (
+            "{}: {}".format(t.filename, t.resource), milliseconds(t.baseline), milliseconds(t.current),
+            "{:+.1f}%".format(t.change * 100) if t.change is not None else "-", t
+        )
+        for t in (regressions if arguments.regressions_only else results)
+    ]
+    header = ("Resource", "Baseline p95", "Current p95", "Change")
+    widths = [max([len(header[n])] + [len(row[n]) for row in rows]) for n in range(4)]
+    line = "{:<{}}  {:>{}}  {:>{}}  {:>{}}  "
+    print(line.format(*(v for pair in zip(header, widths) for v in pair)) + "Trend")
+    print("-" * (sum(widths) + 13))
+    for row in rows:
+        trend = row[4]
+        text = line.format(*(v for pair in zip(row[:4], widths) for v in pair)) + sparkline(trend.per_run)
+        print("{} {}".format(text, colored.red("[REGRESSION]")) if trend.regression else text)
+    print("")
+    print("Runs: {} / Resources: {} / Regressions: {}".format(
+        len(runs), len(results), colored.red(str(len(regressions))) if regressions else 0
+    ))
+    return 1 if regressions else 0
+
+
+def check(arguments):
+    """Report problems found in test files, return exit code"""
+    from .check import Checker
+
+    checker = Checker(arguments.vars)
+    problems = checker.check(arguments.path)
+    for problem in problems:
+        print("{} {}".format(colored.red("[PROBLEM]"), problem))
+    if problems:
         print("")
-    totals = "Total: {} / Passed: {} / Errors: {} / Failed: {}".format(
-        str(passed+failed+errors), colored.green(str(passed)), colored.yellow(str(errors)), colored.red(str(failed))
+    print("Checked files: {} / Problems: {}".format(checker.files, len(problems)))
+    return 1 if problems else 0
+
+
+def summary(totals, control, setup=None):
+    """Print totals, with ones of suite setup when given, return exit code"""
+    if setup is not None:
+        totals = Totals().merge(totals).merge(setup)
+    line = "Total: {} / Passed: {} / Errors: {} / Failed: {}".format(
+        str(totals.total), colored.green(str(totals[PASS])),
+        colored.yellow(str(totals[ERROR])), colored.red(str(totals[FAIL]))
     )
-    print("-" * len(totals))
-    print(totals)
+    if totals[CANCELLED]:
+        line += " / Cancelled: {}".format(colored.yellow(str(totals[CANCELLED])))
+    print("-" * len(line))
+    print(line)
+    if totals.cached:
+        print("Cached: {} / Saved: {} bytes".format(totals.cached, totals.saved))
+    if totals[CANCELLED]:
+        print("Run cancelled: {}".format(control.reason))
     print("")
-    return 1 if (failed or errors) else 0
+    return 0 if totals.ok else 1
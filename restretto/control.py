@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    Run control for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Global deadline and failure limits, shared by everything
+    executing resources during a run
+"""
+
+import time
+import threading
+
+
+class Control(object):
+    """Tracks run deadline and failures, cancelling remaining work once tripped
+
+    Thread-safe, so concurrent executors may share one instance: requests
+    are given timeouts capped by the time left till deadline, so in-flight
+    requests stop no later than the run does. Executors running requests
+    in parallel register cancel hooks, aborting requests in flight as soon
+    as run is cancelled by failures of other ones
+    """
+
+    def __init__(self, deadline=None, max_failures=None):
+        # absolute deadline, monotonic clock
+        self.deadline = time.monotonic() + deadline if deadline is not None else None
+        self.max_failures = max_failures
+        self.failures = 0
+        self.reason = None
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._hooks = []
+
+    def on_cancel(self, hook):
+        """Call hook once run is cancelled, right away if it already is"""
+        with self._lock:
+            if not self._event.is_set():
+                self._hooks.append(hook)
+                return
+        hook()
+
+    def cancel(self, reason):
+        with self._lock:
+            # keep the first reason
+            self.reason = self.reason or reason
+            first = not self._event.is_set()
+            self._event.set()
+            hooks = self._hooks if first else []
+            self._hooks = []
+        for hook in hooks:
+            hook()
+
+    def sleep(self, seconds):
+        """Sleep, waking up on cancel or deadline. Returns False if run is cancelled"""
+        if self.deadline is not None:
+            seconds = min(seconds, max(0, self.deadline - time.monotonic()))
+        self._event.wait(seconds)
+        return not self.cancelled
+
+    @property
+    def remaining(self):
+        """Seconds left till deadline, None without one"""
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.monotonic())
+
+    @property
+    def cancelled(self):
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel('Deadline exceeded')
+        return self.reason is not None
+
+    def record(self, outcome):
+        """Account resource outcome, cancel run if failures limit is reached"""
+        if outcome not in ('fail', 'error'):
+            return
+        with self._lock:
+            self.failures += 1
+            failures = self.failures
+        if self.max_failures and failures >= self.max_failures:
+            self.cancel('Maximum failures reached ({})'.format(failures))
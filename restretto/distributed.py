@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+    Distributed runs for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Coordinator hands out loaded sessions to worker processes, which may
+    run on the same or other machines. Workers stream results back and
+    coordinator merges them into common totals and metrics.
+
+    Protocol is newline-delimited json over tcp:
+
+    * worker -> coordinator: hello, result (one per resource), finished
+    * coordinator -> worker: task (session spec, vars and run options),
+      cancel (run was cancelled, stop running task), done
+
+    Workers execute whatever sessions they are given, including local
+    file uploads and downloads, so coordinator should only listen on
+    trusted networks
+"""
+
+import json
+import queue
+import socket
+import threading
+import time
+
+from .control import Control
+from .metrics import Metrics
+from .runner import Runner, Reporter, Result, Totals, CANCELLED, ERROR, session_title
+
+
+# times task is handed out again after worker has disconnected while running it
+MAX_ATTEMPTS = 3
+
+
+class Channel(object):
+    """Json messages over socket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.lock = threading.Lock()
+
+    def send(self, kind, **message):
+        message['type'] = kind
+        data = json.dumps(message, default=str).encode('utf-8') + b'\n'
+        with self.lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """Return next message, None when connection is closed"""
+        line = self.reader.readline()
+        if not line:
+            return None
+        return json.loads(line.decode('utf-8'))
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class Task(object):
+
+    def __init__(self, id, session):
+        self.id = id
+        self.session = session
+        self.attempts = 0
+
+
+class Coordinator(object):
+    """Distribute sessions between connected workers, collecting results"""
+
+    def __init__(self, sessions, address=('127.0.0.1', 0), context=None, timeout=None,
+                 control=None, reporter=None, metrics=None):
+        self.context = context or {}
+        self.timeout = timeout
+        self.control = control or Control()
+        self.reporter = reporter or Reporter()
+        self.metrics = metrics or Metrics()
+        self.totals = Totals()
+        # session filename -> duration, seconds
+        self.durations = {}
+        self.tasks = queue.Queue()
+        for (n, session) in enumerate(sessions):
+            self.tasks.put(Task(n, session))
+        self.pending = len(sessions)
+        self.condition = threading.Condition()
+        self.listener = socket.create_server(address)
+        self.workers = []
+        # channels of workers running tasks
+        self.busy = set()
+        self.busy_lock = threading.Lock()
+
+    @property
+    def address(self):
+        return self.listener.getsockname()[:2]
+
+    def start(self):
+        self.control.on_cancel(self._cancel_workers)
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _cancel_workers(self):
+        """Tell workers running tasks to stop them"""
+        with self.busy_lock:
+            channels = list(self.busy)
+        for channel in channels:
+            try:
+                channel.send('cancel', reason=self.control.reason)
+            except OSError:
+                # worker disconnected, its task is handled by _serve
+                pass
+
+    def _accept(self):
+        while True:
+            try:
+                (sock, _) = self.listener.accept()
+            except OSError:
+                # listener closed
+                return
+            thread = threading.Thread(target=self._serve, args=(Channel(sock),), daemon=True)
+            self.workers.append(thread)
+            thread.start()
+
+    def _next_task(self, poll=0.1):
+        """Return next task to hand out, None when there is nothing left
+
+        Idle worker waits while other ones are running, because their
+        tasks are handed out again if they disconnect
+        """
+        while not self.control.cancelled:
+            try:
+                return self.tasks.get(timeout=poll)
+            except queue.Empty:
+                with self.condition:
+                    if self.pending <= 0:
+                        return None
+        return None
+
+    def _serve(self, channel):
+        task = None
+        try:
+            if not channel.receive():
+                return
+            while True:
+                task = self._next_task()
+                if task is None:
+                    channel.send('done')
+                    return
+                task.attempts += 1
+                with self.busy_lock:
+                    self.busy.add(channel)
+                channel.send(
+                    'task', id=task.id, spec=task.session.spec, vars=task.session.context, context=self.context,
+                    timeout=self.timeout, deadline=self._remaining(), max_failures=self._failures_left()
+                )
+                results = []
+                while True:
+                    message = channel.receive()
+                    if message is None:
+                        raise ConnectionError('Worker disconnected')
+                    if message['type'] == 'result':
+                        results.append(Result.from_dict(message))
+                    elif message['type'] == 'finished':
+                        break
+                with self.busy_lock:
+                    self.busy.discard(channel)
+                self._commit(task, results, message.get('duration'))
+                task = None
+        except (OSError, ValueError, KeyError, TypeError):
+            # broken connection or malformed message, worker is dropped
+            # and its task is handed out again
+            if task is not None:
+                self._retry(task)
+        finally:
+            with self.busy_lock:
+                self.busy.discard(channel)
+            channel.close()
+
+    def _remaining(self):
+        if self.control.deadline is None:
+            return None
+        return max(0, self.control.deadline - time.monotonic())
+
+    def _failures_left(self):
+        """Failures worker may see before cancelling its task on its own"""
+        if not self.control.max_failures:
+            return None
+        return max(1, self.control.max_failures - self.control.failures)
+
+    def _record(self, result):
+        self.totals.add(result)
+        self.control.record(result.outcome)
+        self.metrics.record(
+            result.session, result.resource, result.outcome, result.elapsed, result.cached, result.saved
+        )
+        self.reporter.result(result)
+
+    def _commit(self, task, results, duration):
+        """Account results of finished task, session output is kept together"""
+        with self.condition:
+            title = session_title(task.session)
+            self.reporter.session_started(title)
+            for result in results:
+                self._record(result)
+            if duration is not None:
+                self.durations[task.session.filename] = duration
+            self.reporter.session_finished(title, duration)
+            self.pending -= 1
+            self.condition.notify_all()
+
+    def _retry(self, task):
+        """Hand task out again, or report it as broken after too many attempts"""
+        if self.control.cancelled:
+            (outcome, message) = (CANCELLED, None)
+        elif task.attempts < MAX_ATTEMPTS:
+            self.tasks.put(task)
+            return
+        else:
+            (outcome, message) = (ERROR, 'Worker disconnected')
+        results = [
+            Result(session_title(task.session), resource.title, outcome, message, filename=task.session.filename)
+            for resource in task.session.resources
+        ]
+        self._commit(task, results, None)
+
+    def _cancel_queued(self):
+        """Account sessions left in queue when run is cancelled"""
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                return
+            with self.condition:
+                for resource in task.session.resources:
+                    self._record(Result(
+                        session_title(task.session), resource.title, CANCELLED, filename=task.session.filename
+                    ))
+                self.pending -= 1
+                self.condition.notify_all()
+
+    def wait(self, poll=0.1):
+        """Wait till all sessions are finished or cancelled, returns totals"""
+        while True:
+            if self.control.cancelled:
+                self._cancel_queued()
+            with self.condition:
+                if self.pending <= 0:
+                    return self.totals
+                self.condition.wait(poll)
+
+    def run(self):
+        self.start()
+        try:
+            return self.wait()
+        finally:
+            self.close()
+
+    def close(self, timeout=1):
+        self.listener.close()
+        # let idle workers receive their 'done'
+        for thread in self.workers:
+            thread.join(timeout)
+
+
+class StreamReporter(Reporter):
+    """Send results to coordinator as they come"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def result(self, result):
+        self.channel.send('result', **result.to_dict())
+
+
+class Worker(object):
+    """Connect to coordinator and run sessions it hands out"""
+
+    def __init__(self, address, transport=None, connect_timeout=30, cache=None):
+        self.address = address
+        self.transport = transport
+        self.cache = cache
+        self.connect_timeout = connect_timeout
+        self.tasks = 0
+        # control of running task and reason run was cancelled by coordinator
+        self.control = None
+        self.cancelled = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Connect to coordinator, waiting for it to start listening"""
+        started = time.monotonic()
+        while True:
+            try:
+                return Channel(socket.create_connection(self.address))
+            except OSError:
+                if time.monotonic() - started > self.connect_timeout:
+                    raise
+                time.sleep(0.1)
+
+    def _receive(self, channel, messages):
+        """Read messages in background, so cancel reaches task while it runs"""
+        while True:
+            try:
+                message = channel.receive()
+            except (OSError, ValueError):
+                message = None
+            if message is not None and message['type'] == 'cancel':
+                with self.lock:
+                    self.cancelled = message.get('reason') or 'Cancelled by coordinator'
+                    control = self.control
+                if control is not None:
+                    control.cancel(self.cancelled)
+                continue
+            messages.put(message)
+            if message is None:
+                return
+
+    def run(self):
+        from .rest import Session
+        channel = self.connect()
+        messages = queue.Queue()
+        threading.Thread(target=self._receive, args=(channel, messages), daemon=True).start()
+        try:
+            channel.send('hello', worker=socket.gethostname())
+            while True:
+                message = messages.get()
+                if message is None or message['type'] == 'done':
+                    return self.tasks
+                session = Session(message['spec'], transport=self.transport, cache=self.cache)
+                # session vars including ones extracted by suite setup
+                session.extend_context(message.get('vars') or {})
+                control = Control(message.get('deadline'), message.get('max_failures'))
+                control.on_cancel(session.http.cancel)
+                with self.lock:
+                    self.control = control
+                    if self.cancelled:
+                        control.cancel(self.cancelled)
+                runner = Runner(message.get('context'), message.get('timeout'), control, StreamReporter(channel))
+                try:
+                    runner.run_session(session)
+                finally:
+                    with self.lock:
+                        self.control = None
+                    session.close()
+                channel.send('finished', id=message['id'], duration=runner.durations.get(session.filename))
+                self.tasks += 1
+        finally:
+            channel.close()
@@ -7,3 +7,15 @@ class ParseError(Exception):
 
 class ExpectError(Exception):
     pass
+
+
+class CancelledError(Exception):
+    pass
+
+
+class TransportError(Exception):
+    pass
+
+
+class RequestTimeout(TransportError):
+    pass
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    Suite fixtures for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sessions may define `setup` resources, tested once before the whole
+    run, and `teardown` ones, tested once after it. Vars extracted by
+    setup resources are shared with contexts of all sessions:
+
+        setup:
+          ttl: 600
+          resources:
+            - name: Login
+              url: /login
+              method: post
+              vars:
+                token: json.token
+        teardown:
+          - name: Logout
+            url: /logout
+            method: post
+
+    With `ttl` extracted vars are cached on local disk, so following
+    runs within `ttl` seconds skip setup entirely. Cache keeps secrets
+    like auth tokens, it is readable by owner only
+"""
+
+import json
+import time
+import hashlib
+
+from .runner import PASS, session_title
+from .utils import load_state, update_state
+
+
+DEFAULT_CACHE = '.restretto-fixtures.json'
+
+
+def load_cache(path):
+    """Return {key: {vars, expires}} entries saved in cache file"""
+    # broken cache just makes setup run again
+    return load_state(path)
+
+
+def save_cache(path, entries):
+    """Merge entries into cache file, dropping expired ones"""
+    def merge(cached):
+        cached.update(entries)
+        now = time.time()
+        return {k: v for (k, v) in cached.items() if isinstance(v, dict) and v.get('expires', 0) > now}
+    update_state(path, merge, permissions=0o600)
+
+
+class Fixtures(object):
+    """Setup and teardown resources of all sessions, run once per suite"""
+
+    def __init__(self, sessions, cache=DEFAULT_CACHE, refresh=False, context=None):
+        self.sessions = sessions
+        self.setups = [s for s in sessions if s.setup]
+        self.teardowns = [s for s in sessions if s.teardown]
+        self.cache = cache
+        # ignore cached vars, running setup again
+        self.refresh = refresh
+        self.context = context or {}
+        # vars extracted by setup resources
+        self.vars = {}
+        # sessions whose setup has passed or was skipped with cached vars
+        self.ready = set()
+
+    def __bool__(self):
+        return bool(self.setups or self.teardowns)
+
+    def key(self, session):
+        """Cache key, changes with setup spec and context it is rendered with"""
+        source = json.dumps(
+            [session.filename, session.spec.get('setup'), session.context, self.context],
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def setup(self, runner):
+        """Run setup resources, sharing extracted vars with all sessions
+
+        Remaining tests are cancelled when setup fails. Returns True on success
+        """
+        entries = load_cache(self.cache) if self.cache else {}
+        now = time.time()
+        updated = False
+        for session in self.setups:
+            key = self.key(session)
+            cached = entries.get(key)
+            if cached and not self.refresh and cached.get('expires', 0) > now:
+                self.vars.update(cached['vars'])
+                self.ready.add(id(session))
+                continue
+            title = '{} (setup)'.format(session_title(session))
+            # failed setup cancels the run, reporting why
+            results = runner.run_resources(session, session.setup, title, fatal='Suite setup failed')
+            if any(result.outcome != PASS for result in results):
+                return False
+            extracted = {}
+            for resource in session.setup:
+                extracted.update(getattr(resource, 'vars', {}))
+            self.vars.update(extracted)
+            self.ready.add(id(session))
+            if session.setup_ttl and self.cache:
+                entries[key] = {'vars': extracted, 'expires': time.time() + session.setup_ttl}
+                updated = True
+        if updated:
+            save_cache(self.cache, entries)
+        for session in self.sessions:
+            session.extend_context(self.vars)
+        return True
+
+    def teardown(self, runner):
+        """Run teardown resources once, returns their results
+
+        Teardown of session whose setup has failed or was not run is
+        skipped, there is nothing to clean up after it
+        """
+        results = []
+        for session in self.teardowns:
+            if session.setup and id(session) not in self.ready:
+                continue
+            title = '{} (teardown)'.format(session_title(session))
+            results.extend(runner.run_resources(session, session.teardown, title))
+        return results
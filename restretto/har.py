@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+    HAR capture for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Requests and responses are appended to HAR 1.2 file as resources
+    are tested, so whole run is never kept in memory. Session titles
+    become HAR pages, allowing to inspect scenarios separately
+"""
+
+import json
+import threading
+from base64 import b64encode
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qsl
+
+from . import __version__
+from .runner import Reporter
+
+
+TEXT_TYPES = ('text/', 'json', 'xml', 'javascript', 'x-www-form-urlencoded')
+
+
+def timestamp(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else -1
+
+
+def name_values(items):
+    return [{'name': str(name), 'value': str(value)} for (name, value) in items]
+
+
+class HarWriter(Reporter):
+    """Stream tested resources requests and responses into HAR file"""
+
+    def __init__(self, path, max_body=None):
+        # response bodies are truncated to max_body bytes, 0 omits them
+        self.max_body = max_body
+        self.output = open(path, 'w')
+        self.pages = []
+        self.page = None
+        self.entries = 0
+        self.lock = threading.Lock()
+        self.output.write('{"log": {"version": "1.2", "creator": ')
+        self.output.write(json.dumps({'name': 'restretto', 'version': __version__}))
+        self.output.write(', "entries": [\n')
+        self.output.flush()
+
+    def session_started(self, title):
+        self.page = 'page_{}'.format(len(self.pages) + 1)
+        self.pages.append({
+            'id': self.page, 'title': title,
+            'startedDateTime': datetime.now(timezone.utc).isoformat(), 'pageTimings': {}
+        })
+
+    def result(self, result):
+        response = result.response
+        if response is None or response.request is None:
+            # nothing was received or request details are unknown
+            return
+        entry = self.entry(response)
+        entry['comment'] = '{}: {}{}'.format(
+            result.resource, result.outcome, ' ({})'.format(result.message) if result.message else ''
+        )
+        if self.page:
+            entry['pageref'] = self.page
+        with self.lock:
+            if self.entries:
+                self.output.write(',\n')
+            json.dump(entry, self.output)
+            self.output.flush()
+            self.entries += 1
+
+    def content(self, response):
+        content = {
+            'size': response.body_size,
+            'compression': response.body_size - (response.transfer_size or response.body_size),
+            'mimeType': response.headers.get('Content-Type', '')
+        }
+        if self.max_body == 0:
+            return content
+        body = response.content
+        if self.max_body is not None and len(body) > self.max_body:
+            body = body[:self.max_body]
+            content['comment'] = 'truncated to {} bytes'.format(self.max_body)
+        if any(t in content['mimeType'] for t in TEXT_TYPES):
+            content['text'] = body.decode(response.encoding, errors='replace')
+        else:
+            content['text'] = b64encode(body).decode('ascii')
+            content['encoding'] = 'base64'
+        return content
+
+    def entry(self, response):
+        request = response.request
+        body = request.body if isinstance(request.body, (str, bytes)) else None
+        timings = {
+            'blocked': -1, 'dns': -1, 'connect': -1, 'ssl': -1, 'send': 0,
+            'wait': milliseconds(response.timings.get('wait')),
+            'receive': milliseconds(response.timings.get('receive'))
+        }
+        entry = {
+            'startedDateTime': timestamp(response.started),
+            'time': sum(t for t in timings.values() if t > 0),
+            'request': {
+                'method': request.method,
+                'url': request.url,
+                'httpVersion': 'HTTP/1.1',
+                'cookies': [],
+                'headers': name_values(request.headers.items()),
+                'queryString': name_values(parse_qsl(urlsplit(request.url).query, keep_blank_values=True)),
+                'headersSize': -1,
+                'bodySize': len(body) if body else 0
+            },
+            'response': {
+                'status': response.status_code,
+                'statusText': response.reason or '',
+                'httpVersion': 'HTTP/1.1',
+                'cookies': [],
+                'headers': name_values(response.headers.items()),
+                'content': self.content(response),
+                'redirectURL': response.headers.get('Location', ''),
+                'headersSize': -1,
+                'bodySize': response.transfer_size if response.transfer_size is not None else -1
+            },
+            'cache': {},
+            'timings': timings
+        }
+        if body:
+            if isinstance(body, bytes):
+                body = body.decode('utf-8', errors='replace')
+            entry['request']['postData'] = {
+                'mimeType': request.headers.get('Content-Type', ''), 'text': body
+            }
+        return entry
+
+    def close(self):
+        with self.lock:
+            self.output.write('\n], "pages": ')
+            json.dump(self.pages, self.output)
+            self.output.write('}}\n')
+            self.output.close()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+    Performance history for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Runs append per-resource outcomes and timings to local SQLite
+    database, resources are keyed by session file and resource title.
+    Report compares p95 latency of recent runs with baseline window of
+    runs before them, flagging resources which got slower beyond
+    threshold, so CI can fail on performance regressions
+"""
+
+import os
+import threading
+import time
+
+from .runner import Reporter, PASS, FAIL
+
+
+DEFAULT_HISTORY = '.restretto-history.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    path TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    filename TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    elapsed REAL
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run);
+'''
+
+# outcomes with meaningful response time
+TIMED_OUTCOMES = (PASS, FAIL)
+
+# baseline runs resource should have timings in to be flagged, single
+# samples are too noisy to tell regressions
+MIN_BASELINE = 3
+
+SPARKS = '▁▂▃▄▅▆▇█'
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values, None when there are none"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def sparkline(values):
+    """Render values as bars, missing ones as spaces"""
+    known = [v for v in values if v is not None]
+    if not known:
+        return ''
+    (low, high) = (min(known), max(known))
+    scale = (len(SPARKS) - 1) / (high - low) if high > low else 0
+    return ''.join(' ' if v is None else SPARKS[int((v - low) * scale)] for v in values)
+
+
+class History(object):
+    """SQLite store of resource results across runs"""
+
+    def __init__(self, path=DEFAULT_HISTORY):
+        import sqlite3
+        self.path = path
+        # results are recorded from runner threads
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def start_run(self, path=None):
+        """Register new run, returns its id"""
+        with self.lock, self.db:
+            return self.db.execute(
+                'INSERT INTO runs (started, path) VALUES (?, ?)', (time.time(), path)
+            ).lastrowid
+
+    def add(self, run, results):
+        """Append (filename, resource, outcome, elapsed) rows of run"""
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT INTO results (run, filename, resource, outcome, elapsed) VALUES (?, ?, ?, ?, ?)',
+                ((run,) + tuple(row) for row in results)
+            )
+
+    def runs(self, limit=None):
+        """Ids of recorded runs, oldest first"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT id FROM runs ORDER BY id DESC LIMIT ?', (limit if limit else -1,)
+            ).fetchall()
+        return [run for (run,) in reversed(rows)]
+
+    def timings(self, runs):
+        """Return {(filename, resource): {run: [elapsed, ...]}} of given runs"""
+        timings = {}
+        if not runs:
+            return timings
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT run, filename, resource, elapsed FROM results '
+                'WHERE run IN ({}) AND elapsed IS NOT NULL AND outcome IN (?, ?)'.format(
+                    ','.join('?' * len(runs))
+                ), tuple(runs) + TIMED_OUTCOMES
+            ).fetchall()
+        for (run, filename, resource, elapsed) in rows:
+            timings.setdefault((filename, resource), {}).setdefault(run, []).append(elapsed)
+        return timings
+
+    def close(self):
+        self.db.close()
+
+
+class HistoryReporter(Reporter):
+    """Collect results of the run, saving them to history at once on close"""
+
+    def __init__(self, history, path=None):
+        self.history = history
+        self.run = history.start_run(path)
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def result(self, result):
+        with self.lock:
+            self.rows.append((
+                os.path.normpath(result.filename) if result.filename else result.session,
+                result.resource, result.outcome, result.elapsed
+            ))
+
+    def close(self):
+        with self.lock:
+            (rows, self.rows) = (self.rows, [])
+        self.history.add(self.run, rows)
+
+
+class Trend(object):
+    """Latency trend of single resource"""
+
+    def __init__(self, filename, resource, current, baseline, per_run, baseline_runs=0):
+        self.filename = filename
+        self.resource = resource
+        # p95 of current and baseline windows, seconds
+        self.current = current
+        self.baseline = baseline
+        # p95 of every run, oldest first
+        self.per_run = per_run
+        # baseline runs with timings of resource
+        self.baseline_runs = baseline_runs
+        self.regression = False
+
+    @property
+    def change(self):
+        """Relative p95 change, None if either window has no timings"""
+        if self.current is None or not self.baseline:
+            return None
+        return self.current / self.baseline - 1
+
+
+def trends(history, window=1, baseline=5, threshold=0.2, min_baseline=MIN_BASELINE):
+    """Compare p95 of last `window` runs with `baseline` runs before them
+
+    Returns list of Trend, regressions are ones whose p95 grew by more
+    than `threshold` (relative) and which have timings in at least
+    `min_baseline` baseline runs
+    """
+    runs = history.runs(window + baseline)
+    current_runs = set(runs[-window:]) if window else set()
+    timings = history.timings(runs)
+    result = []
+    for ((filename, resource), by_run) in sorted(timings.items()):
+        current = [e for (run, values) in by_run.items() if run in current_runs for e in values]
+        previous = [e for (run, values) in by_run.items() if run not in current_runs for e in values]
+        trend = Trend(
+            filename, resource, percentile(current, 95), percentile(previous, 95),
+            [percentile(by_run.get(run, []), 95) for run in runs],
+            len([run for run in by_run if run not in current_runs])
+        )
+        trend.regression = trend.change is not None and trend.change > threshold \
+            and trend.baseline_runs >= min_baseline
+        result.append(trend)
+    return result
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    Last run results for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Every run records whether each session failed, together with digest
+    of its file and var files it includes. Following runs may use them
+    to run only sessions failed last time or changed since they were
+    run, or to run failed sessions first
+"""
+
+import os
+import hashlib
+import threading
+
+from .runner import Reporter, PASS, CANCELLED
+from .utils import load_state, update_state
+
+
+DEFAULT_RESULTS = '.restretto-results.json'
+
+
+def digest(session):
+    """Digest of session file and var files it includes"""
+    sha = hashlib.sha256()
+    for path in [session.filename] + list(session.spec.get('var_files', [])):
+        sha.update(os.path.normpath(path).encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as source:
+                sha.update(source.read())
+        except OSError:
+            sha.update(b'\0missing')
+    return sha.hexdigest()
+
+
+def load_results(path):
+    """Return {session filename: {digest, failed}} recorded in results file"""
+    # broken results file just makes every session look changed
+    return {k: v for (k, v) in load_state(path).items() if isinstance(v, dict)}
+
+
+def save_results(path, entries):
+    """Merge session results into results file, dropping ones of removed files"""
+    def merge(results):
+        results.update(entries)
+        return {k: v for (k, v) in results.items() if os.path.exists(k)}
+    update_state(path, merge)
+
+
+def key(session):
+    return os.path.normpath(session.filename)
+
+
+def digests(sessions):
+    """Return {session filename: digest} of sessions loaded from files"""
+    return {key(s): digest(s) for s in sessions if s.filename}
+
+
+def failed(session, results):
+    return bool(results.get(key(session), {}).get('failed'))
+
+
+def changed(session, results, digests):
+    """Whether session was not run yet or its files changed since"""
+    return results.get(key(session), {}).get('digest') != digests[key(session)]
+
+
+def select(sessions, results, digests, last_failed=False, changed_only=False, failed_first=False):
+    """Return sessions to run, in order to run them
+
+    With both `last_failed` and `changed_only` sessions matching either
+    of them are selected. When no session failed last time `last_failed`
+    alone selects all of them, so fixed suite is run in full again
+    """
+    sessions = [s for s in sessions if s.filename]
+    if last_failed and not any(failed(s, results) for s in sessions):
+        last_failed = False
+        if not changed_only:
+            return sessions
+    if last_failed or changed_only:
+        sessions = [
+            s for s in sessions
+            if (last_failed and failed(s, results)) or (changed_only and changed(s, results, digests))
+        ]
+    if failed_first:
+        # stable sort keeps loading order within both groups
+        sessions = sorted(sessions, key=lambda s: not failed(s, results))
+    return sessions
+
+
+class ResultsReporter(Reporter):
+    """Collect session outcomes, merging them into results file on close
+
+    Sessions with cancelled resources and no failures are not recorded,
+    so their previous state is kept
+    """
+
+    def __init__(self, path, digests):
+        self.path = path
+        # filename -> digest of files session was loaded from
+        self.digests = digests
+        # filename -> set of outcomes
+        self.outcomes = {}
+        self.lock = threading.Lock()
+
+    def result(self, result):
+        if not result.filename:
+            return
+        with self.lock:
+            self.outcomes.setdefault(os.path.normpath(result.filename), set()).add(result.outcome)
+
+    def close(self):
+        with self.lock:
+            (outcomes, self.outcomes) = (self.outcomes, {})
+        entries = {}
+        for (filename, seen) in outcomes.items():
+            failures = bool(seen - {PASS, CANCELLED})
+            if filename in self.digests and (failures or CANCELLED not in seen):
+                entries[filename] = {'digest': self.digests[filename], 'failed': failures}
+        if entries:
+            save_results(self.path, entries)
@@ -13,18 +13,22 @@ from .rest import Session
 SUPPORTED_EXTENSIONS = (".yml", ".yaml")
 
 
+def var_file_paths(src, files):
+    """Return paths of var files, which are given relative to session file"""
+    base = os.path.dirname(src)
+    return [os.path.join(base, f) for f in files]
+
+
 def load_var_files(src, files):
     all_vars = {}
-    base = os.path.dirname(src)
-    for f in files:
-        src = os.path.join(base, f)
+    for src in var_file_paths(src, files):
         with open(src) as var_file:
             all_vars.update(yaml.full_load(var_file))
     return all_vars
 
 
-def load(path):
-    data = []
+def find_files(path):
+    """Return test files found at path"""
     files = []
     if os.path.isdir(path):
         # load only files with supported extension skipping hiddens like '.yml'
@@ -35,21 +39,34 @@ def load(path):
                     files.append(os.path.join(curdir, entry))
     else:
         files.append(path)
-    for entry in files:
-        with open(entry) as source:
-            parsed = yaml.full_load(source)
-        # silently skip empty files
-        if not parsed:
-            continue
-        # add filename to spec
-        parsed['filename'] = entry
-        # parse vars files, if any
-        var_data = parsed.get('vars', None)
-        if  type(var_data) is str:
-            parsed["vars"] = load_var_files(entry, [var_data])
-        elif type(var_data) is list:
-            # parse set of file
-            parsed["vars"] = load_var_files(entry, var_data)
-        data.append(Session(parsed))
+    return files
+
+
+def load_spec(entry):
+    """Return session spec parsed from file, None for empty files"""
+    with open(entry) as source:
+        parsed = yaml.full_load(source)
+    # silently skip empty files
+    if not parsed:
+        return None
+    # add filename to spec
+    parsed['filename'] = entry
+    # parse vars files, if any
+    var_data = parsed.get('vars', None)
+    if  type(var_data) is str:
+        var_data = [var_data]
+    if type(var_data) is list:
+        # parse set of file, keeping their paths to know what session depends on
+        parsed["vars"] = load_var_files(entry, var_data)
+        parsed["var_files"] = var_file_paths(entry, var_data)
+    return parsed
+
+
+def load(path, transport=None, cache=None):
+    data = []
+    for entry in find_files(path):
+        parsed = load_spec(entry)
+        if parsed:
+            data.append(Session(parsed, transport=transport, cache=cache))
     # filter out empty elements (loaded from empty files)
     return [item for item in data if item]
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+    Run metrics for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Per-resource counters and latency histograms, rendered
+    in OpenMetrics text format
+"""
+
+import threading
+from bisect import bisect_left
+
+
+# default latency buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+OUTCOMES = ('pass', 'fail', 'error', 'cancelled')
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+class Histogram(object):
+    """Cumulative-on-render latency histogram"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        # last slot counts observations above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError('Histogram buckets mismatch')
+        self.counts = [a + b for (a, b) in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        return self
+
+    def cumulative(self):
+        """Yield (upper bound, cumulative count) pairs, including +Inf"""
+        total = 0
+        for (bound, count) in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield (bound, total)
+
+
+class ResourceStats(object):
+    """Outcome counters and latency histogram of single resource"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.latency = Histogram(buckets)
+        self.last_outcome = None
+        # responses served by client side cache and transfer bytes saved
+        self.cached = 0
+        self.saved = 0
+
+    def record(self, outcome, elapsed=None, cached=False, saved=0):
+        self.outcomes[outcome] += 1
+        self.last_outcome = outcome
+        if elapsed is not None:
+            self.latency.observe(elapsed)
+        self.cached += int(cached)
+        self.saved += saved
+
+    def merge(self, other):
+        for (outcome, count) in other.outcomes.items():
+            self.outcomes[outcome] += count
+        self.latency.merge(other.latency)
+        self.cached += other.cached
+        self.saved += other.saved
+        self.last_outcome = other.last_outcome or self.last_outcome
+        return self
+
+
+def escape(value):
+    """Escape label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**pairs):
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for (k, v) in pairs.items()) + '}'
+
+
+def number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """Thread-safe per-resource stats registry keyed by (session, resource)"""
+
+    PREFIX = 'restretto'
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.resources = {}
+        self.lock = threading.Lock()
+
+    def record(self, session, resource, outcome, elapsed=None, cached=False, saved=0):
+        with self.lock:
+            stats = self.resources.get((session, resource))
+            if stats is None:
+                stats = self.resources[(session, resource)] = ResourceStats(self.buckets)
+            stats.record(outcome, elapsed, cached, saved)
+
+    def merge(self, other):
+        with self.lock:
+            for (key, stats) in other.resources.items():
+                own = self.resources.setdefault(key, ResourceStats(self.buckets))
+                own.merge(stats)
+        return self
+
+    def render(self):
+        """Render all metrics in OpenMetrics text exposition format"""
+        with self.lock:
+            items = sorted(self.resources.items())
+            lines = []
+            name = '{}_resource_success'.format(self.PREFIX)
+            lines.append('# TYPE {} gauge'.format(name))
+            lines.append('# HELP {} Whether last test of resource has passed'.format(name))
+            for ((session, resource), stats) in items:
+                lines.append('{}{} {}'.format(
+                    name, labels(session=session, resource=resource),
+                    int(stats.last_outcome == 'pass')
+                ))
+            name = '{}_resource_tests'.format(self.PREFIX)
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('# HELP {} Resource tests by outcome'.format(name))
+            for ((session, resource), stats) in items:
+                for outcome in OUTCOMES:
+                    lines.append('{}_total{} {}'.format(
+                        name, labels(session=session, resource=resource, outcome=outcome),
+                        stats.outcomes[outcome]
+                    ))
+            name = '{}_resource_duration_seconds'.format(self.PREFIX)
+            lines.append('# TYPE {} histogram'.format(name))
+            lines.append('# UNIT {} seconds'.format(name))
+            lines.append('# HELP {} Resource request duration'.format(name))
+            for ((session, resource), stats) in items:
+                for (bound, count) in stats.latency.cumulative():
+                    lines.append('{}_bucket{} {}'.format(
+                        name, labels(session=session, resource=resource, le=number(bound)), count
+                    ))
+                lines.append('{}_count{} {}'.format(
+                    name, labels(session=session, resource=resource), stats.latency.count
+                ))
+                lines.append('{}_sum{} {}'.format(
+                    name, labels(session=session, resource=resource), number(stats.latency.sum)
+                ))
+            name = '{}_resource_cache_hits'.format(self.PREFIX)
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('# HELP {} Responses served by client side cache'.format(name))
+            for ((session, resource), stats) in items:
+                lines.append('{}_total{} {}'.format(
+                    name, labels(session=session, resource=resource), stats.cached
+                ))
+            name = '{}_resource_cache_saved_bytes'.format(self.PREFIX)
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('# UNIT {} bytes'.format(name))
+            lines.append('# HELP {} Transfer bytes saved by client side cache'.format(name))
+            for ((session, resource), stats) in items:
+                lines.append('{}_total{} {}'.format(
+                    name, labels(session=session, resource=resource), stats.saved
+                ))
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
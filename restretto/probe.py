@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+    Continuous synthetic probing for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Loaded sessions are tested over and over again, keeping parsed
+    resources and http connection pools warm between iterations
+"""
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .metrics import Metrics, CONTENT_TYPE
+from .runner import Runner, Reporter
+from .utils import atomic_write
+
+
+class MetricsReporter(Reporter):
+    """Record results into metrics, passing them further to another reporter"""
+
+    def __init__(self, metrics, reporter=None):
+        self.metrics = metrics
+        self.reporter = reporter or Reporter()
+
+    def session_started(self, title):
+        self.reporter.session_started(title)
+
+    def result(self, result):
+        self.metrics.record(
+            result.session, result.resource, result.outcome, result.elapsed, result.cached, result.saved
+        )
+        self.reporter.result(result)
+
+    def session_finished(self, title, duration):
+        self.reporter.session_finished(title, duration)
+
+
+class Probe(object):
+    """Repeatedly test sessions, collecting per-resource metrics"""
+
+    def __init__(self, sessions, interval=30, context=None, timeout=None, metrics=None, reporter=None):
+        self.sessions = sessions
+        self.interval = interval
+        self.metrics = metrics or Metrics()
+        self.runner = Runner(context, timeout, reporter=MetricsReporter(self.metrics, reporter))
+        self.iterations = 0
+
+    def iteration(self):
+        """Test every resource of every session once"""
+        self.runner.run(self.sessions)
+        self.iterations += 1
+
+    def run(self, iterations=None, on_iteration=None):
+        """Probe every `interval` seconds, forever or given number of times"""
+        while iterations is None or self.iterations < iterations:
+            started = time.monotonic()
+            self.iteration()
+            if on_iteration:
+                on_iteration(self)
+            if iterations is not None and self.iterations >= iterations:
+                break
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+
+def write_metrics(path, metrics):
+    """Atomically replace metrics file, so scrapers never read partial data"""
+    with atomic_write(path) as output:
+        output.write(metrics.render())
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serve metrics over http from background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, metrics, address=('127.0.0.1', 0)):
+        self.metrics = metrics
+        super().__init__(address, MetricsHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep probe output clean
+        pass
@@ -4,19 +4,30 @@
     ~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+import copy
 import time
-import requests
-from urllib.request import urljoin
+from urllib.parse import urljoin
 
 from .utils import json_path
 from . import assertions
-from .errors import ParseError
-from .utils import apply_context
+from .errors import ParseError, CancelledError
+from .utils import apply_context, parse_size
+from .transport import get_transport
 
 
 HTTP_METHODS = frozenset(('get', 'options', 'head', 'post', 'put', 'patch', 'delete'))
 
 
+def remaining_timeout(timeout=None, deadline=None):
+    """Cap request timeout by time left till deadline (monotonic clock)"""
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise CancelledError('Deadline exceeded')
+    return remaining if timeout is None else min(timeout, remaining)
+
+
 class Resource(object):
     """Single HTTP resource"""
 
@@ -73,53 +84,80 @@ class Resource(object):
         # set download path for response, if required
         self.download = self.spec.get('download', None)
 
+        # request timeout in seconds, overrides session and run defaults
+        self.timeout = self.spec.get('timeout', None)
+        # response body size limit, overrides session default
+        self.max_body = parse_size(self.spec.get('max_body', None))
+
         self.request = self.parse_from_dict(self.spec)
-        # response and errors are not known
+        # response, errors and timing are not known
         self.response = None
         self.error = None
+        self.elapsed = None
 
     @property
     def title(self):
         return self.spec.get('title') or self.spec.get('name') \
             or '{method} {url}'.format(**self.request)
 
-    def test(self, baseUri='', context={}, session=None):
+    def test(self, baseUri='', context={}, session=None, timeout=None, deadline=None, max_body=None,
+             control=None):
         """Make request, perform assertion testing"""
-        self.request['url'] = urljoin(baseUri, self.request['url'].lstrip('/'))
+        # render request and assertions into copies, so parsed spec stays
+        # untouched and resource can be tested repeatedly
+        request = dict(self.request)
+        request['url'] = urljoin(baseUri, request['url'].lstrip('/'))
         # apply template to request and assertions
-        self.request = apply_context(self.request, context)
-        self.asserts = apply_context(self.asserts, context)
+        request = apply_context(request, context)
+        asserts = apply_context(self.asserts, context)
         # load files, if provided
         # TODO: add mimetype detection
         # TODO: files should be searched relative to current yml
         # see https://github.com/wirewit/restretto/issues/16 for details
-        file_data = self.request.pop('files', {})
+        file_data = request.pop('files', {})
         if type(file_data) is list:
             # parsing files: [file1, file2] structure, assuming name as "files"
             file_data = {
                 'files': file_data
             }
         # TODO: raise exception on parsing not-dict structure
-        if type(file_data) is dict:
+        if type(file_data) is dict and file_data:
             # parsing name: file or name: [file1, file2] structure
-            self.request['files'] = []
+            request['files'] = []
             for file_name, file_path in file_data.items():
                 if type(file_path) is str:
-                    self.request['files'].append((file_name, open(file_path, 'rb')))
+                    request['files'].append((file_name, open(file_path, 'rb')))
                 elif type(file_path) is list:
                     for f in file_path:
-                        self.request['files'].append((file_name, open(f, 'rb')))
+                        request['files'].append((file_name, open(f, 'rb')))
 
         # make sure all headers are strings
-        if "headers" in self.request:
-            for k, v in self.request["headers"].items():
-                self.request["headers"][k] = str(v)
+        if "headers" in request:
+            for k, v in request["headers"].items():
+                request["headers"][k] = str(v)
 
         # create assertions
-        assertion = assertions.Assert(self.asserts)
+        assertion = assertions.Assert(asserts)
+        self.response = None
+        self.error = None
         # get response
-        http = session or requests.Session()
-        self.response = http.request(**self.request)
+        http = session or get_transport()()
+        timeout = self.timeout if self.timeout is not None else timeout
+        request['max_body'] = self.max_body if self.max_body is not None else max_body
+        started = time.monotonic()
+        try:
+            if control is not None and control.cancelled:
+                # cancelled by other executor while request was being prepared
+                raise CancelledError(control.reason)
+            request['timeout'] = remaining_timeout(timeout, deadline)
+            self.response = http.request(**request)
+        except Exception as error:
+            self.error = error
+            raise
+        finally:
+            self.elapsed = time.monotonic() - started
+            for (_, upload) in request.get('files', []):
+                upload.close()
         # test assertion, will raise an excep
         try:
             assertion.test(self.response)
@@ -129,7 +167,7 @@ class Resource(object):
             # reraise
             raise
         # save context vars
-        if self.vars:
+        if self.spec.get('vars'):
             data = {
                 'headers': self.response.headers
             }
@@ -139,8 +177,9 @@ class Resource(object):
                 # no json, it's can be ok
                 data['json'] = None
                 pass
-            for name, path in self.vars.items():
-                self.vars[name] = json_path(path, data)
+            self.vars = {
+                name: json_path(path, data) for name, path in self.spec['vars'].items()
+            }
 
         # save response body as downloaded file
         # path taken relative to cwd, may be should be changed to yml-related path
@@ -158,48 +197,110 @@ class Wait(object):
         self.spec = spec
         self.vars = {}
         self.delay = int(spec.get("wait", 0))
+        self.response = None
+        self.error = None
+        self.elapsed = None
 
     @property
     def title(self):
         return self.spec.get('title') or self.spec.get('name') \
             or 'Waiting for {} second(s)'.format(self.delay)
 
-    def test(self, *args, **kwargs):
-        time.sleep(self.delay)
+    def test(self, *args, deadline=None, control=None, **kwargs):
+        delay = remaining_timeout(self.delay, deadline)
+        started = time.monotonic()
+        if control is not None:
+            # wakes up as soon as run is cancelled
+            completed = control.sleep(delay)
+        else:
+            time.sleep(delay)
+            completed = True
+        self.elapsed = time.monotonic() - started
+        if not completed:
+            raise CancelledError(control.reason)
+        if delay < self.delay:
+            raise CancelledError('Deadline exceeded')
         return self
 
 
 class Session(object):
     """REST session"""
 
-    def __init__(self, spec, context={}):
+    def __init__(self, spec, context={}, transport=None, cache=None, pool=None):
         self.spec = spec
         self.context = spec.get('vars', {}).copy()
         self.context.update(context)
-        self.baseUri = apply_context(spec.get('baseUri', ''), self.context)
-        self.http = requests.Session()
+        self._render()
+        if pool is not None:
+            # reuse connections of long living transport
+            self.http = pool.fork()
+            self.http.update_headers(self.headers)
+        else:
+            self.http = get_transport(transport)(self.headers, verify=spec.get('verify', False))
+        if cache or spec.get('cache'):
+            from .cache import CachingTransport
+            self.http = CachingTransport(self.http)
+        # default request timeout and body size limit for session resources
+        self.timeout = spec.get('timeout', None)
+        self.max_body = parse_size(spec.get('max_body', None))
+        # create resources
+        self.resources = self._parse_resources(self.spec.get('resources'))
+        # suite fixtures, given as list of resources or dict with resources and ttl
+        setup = self.spec.get('setup') or {}
+        if isinstance(setup, list):
+            setup = {'resources': setup}
+        self.setup = self._parse_resources(setup.get('resources'))
+        # seconds extracted setup vars may be cached for
+        self.setup_ttl = setup.get('ttl', 0)
+        self.teardown = self._parse_resources(self.spec.get('teardown'))
+
+    def _render(self):
+        """Apply context to session-wide settings"""
+        self.baseUri = apply_context(self.spec.get('baseUri', ''), self.context)
         headers = self.spec.get('headers') or {}
         self.headers = apply_context(headers, self.context)
         # make sure all headers are strings
         for k, v in self.headers.items():
             self.headers[k] = str(v)
-        self.http.headers.update(self.headers)
-        self.http.verify = spec.get('verify', False)
-        # create resources
-        self.resources = []
-        self._parse_resources()
 
-    def _parse_resources(self):
+    @staticmethod
+    def _parse_resources(entries):
         """Get resources from loaded session spec"""
-        entries = self.spec.get('resources') or []
-        for item in entries:
+        resources = []
+        for item in entries or []:
             if "wait" in item:
-                self.resources.append(Wait(item))
+                resources.append(Wait(item))
             else:
-                self.resources.append(Resource(item))
+                resources.append(Resource(item))
+        return resources
+
+    def extend_context(self, values):
+        """Add vars defined outside of session, session own vars take precedence"""
+        context = dict(values)
+        context.update(self.context)
+        self.context = context
+        self._render()
+        self.http.update_headers(self.headers)
+
+    def fork(self):
+        """Session copy for virtual user
+
+        Copy has own context, cookies and resources state, while sharing
+        parsed spec, compiled templates and connection pools
+        """
+        forked = copy.copy(self)
+        forked.context = dict(self.context)
+        forked.headers = dict(self.headers)
+        forked.http = self.http.fork()
+        forked.resources = self._parse_resources(self.spec.get('resources'))
+        return forked
 
     def __bool__(self):
-        return bool(self.resources)
+        return bool(self.resources or self.setup or self.teardown)
+
+    def close(self):
+        """Release transport connections"""
+        self.http.close()
 
     @property
     def filename(self):
@@ -209,9 +310,14 @@ class Session(object):
     def title(self):
         return self.spec.get('title', '') or self.spec.get('name', '') or self.spec.get('session', '')
 
-    def test(self, resource=None, context=None):
+    def test(self, resource=None, context=None, timeout=None, deadline=None, control=None):
         context = context or {}
         context.update(self.context)
-        executed = resource.test(self.baseUri, context, self.http)
+        if self.timeout is not None:
+            timeout = self.timeout
+        executed = resource.test(
+            self.baseUri, context, self.http,
+            timeout=timeout, deadline=deadline, max_body=self.max_body, control=control
+        )
         self.context.update(executed.vars)
         return executed
@@ -1,66 +1,202 @@
-#!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+    Sessions runner for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-import logging
-import requests
-from urllib.request import urljoin
-from . import templating
-from . import assertions
+    Tests session resources one by one, classifying outcomes and
+    passing results to reporter
+"""
 
-logger = logging.getLogger(__name__)
-#logging.basicConfig(level=logging.DEBUG)
+import time
+
+from .control import Control
+from .errors import ExpectError, CancelledError
+
+
+PASS, FAIL, ERROR, CANCELLED = 'pass', 'fail', 'error', 'cancelled'
+
+OUTCOMES = (PASS, FAIL, ERROR, CANCELLED)
 
 
 class Result(object):
+    """Outcome of single resource test"""
+
+    def __init__(self, session, resource, outcome, message=None, elapsed=None, response=None,
+                 cached=None, saved=None, filename=None):
+        # session and resource titles, session file
+        self.session = session
+        self.resource = resource
+        self.filename = filename
+        self.outcome = outcome
+        self.message = message
+        self.elapsed = elapsed
+        # response is only available for locally executed resources
+        self.response = response
+        # served by client side cache and transfer bytes saved
+        self.cached = getattr(response, 'cached', False) if cached is None else cached
+        self.saved = getattr(response, 'saved', 0) if saved is None else saved
+
+    def to_dict(self):
+        return {
+            'session': self.session, 'resource': self.resource, 'outcome': self.outcome,
+            'message': self.message, 'elapsed': self.elapsed, 'cached': self.cached, 'saved': self.saved,
+            'filename': self.filename
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['session'], data['resource'], data['outcome'], data.get('message'), data.get('elapsed'),
+            cached=data.get('cached', False), saved=data.get('saved', 0), filename=data.get('filename')
+        )
+
+
+class Totals(object):
+    """Results counters"""
 
-    def __init__(self, title=None):
-        self.title = title
-        self.failures = []
-        self.succeed = []
+    def __init__(self):
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        # responses served by client side cache and transfer bytes saved
+        self.cached = 0
+        self.saved = 0
+
+    def add(self, result):
+        self.counts[result.outcome] += 1
+        self.cached += int(result.cached)
+        self.saved += result.saved
+
+    def merge(self, other):
+        for (outcome, count) in other.counts.items():
+            self.counts[outcome] += count
+        self.cached += other.cached
+        self.saved += other.saved
+        return self
+
+    def __getitem__(self, outcome):
+        return self.counts[outcome]
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
 
     @property
     def ok(self):
-        return len(self.failures) == 0
+        return not (self.counts[FAIL] or self.counts[ERROR] or self.counts[CANCELLED])
+
+
+def session_title(session):
+    return session.title or session.filename or ''
+
+
+class Reporter(object):
+    """Receives run events, does nothing by default"""
+
+    def session_started(self, title):
+        pass
+
+    def result(self, result):
+        pass
+
+    def session_finished(self, title, duration):
+        pass
+
+
+class MultiReporter(Reporter):
+    """Pass events to several reporters"""
+
+    def __init__(self, *reporters):
+        self.reporters = reporters
+
+    def session_started(self, title):
+        for reporter in self.reporters:
+            reporter.session_started(title)
+
+    def result(self, result):
+        for reporter in self.reporters:
+            reporter.result(result)
+
+    def session_finished(self, title, duration):
+        for reporter in self.reporters:
+            reporter.session_finished(title, duration)
 
 
 class Runner(object):
+    """Run sessions resource by resource"""
 
-    def __init__(self, spec, context={}):
-        # define context
-        self.context = spec.get('vars', {})
-        self.context.update(context)
-        # apply context
-        self.spec = templating.apply_session_context(spec, self.context)
-        # setup session
-        self.session = requests.Session()
-        self.session.headers.update(self.spec.get('headers', {}))
-        self.baseUri = spec.get('baseUri', '')
-        # prepare result
-        self.result = Result(self.spec.get('title', ''))
+    def __init__(self, context=None, timeout=None, control=None, reporter=None):
+        self.context = context or {}
+        self.timeout = timeout
+        self.control = control or Control()
+        self.reporter = reporter or Reporter()
+        self.totals = Totals()
+        # session filename -> duration, seconds
+        self.durations = {}
 
-    @property
-    def actions(self):
-        return self.spec['actions']
-
-    def execute(self, action):
-        # apply context for request
-        spec = templating.apply_action_context(action, self.context)
-        # create assertions
-        assertion = assertions.Assert(spec.pop('assert') if 'assert' in spec else [])
-        # get response
-        response = self.request(**spec)
-        # test assertion
+    def record(self, result):
+        self.totals.add(result)
+        self.control.record(result.outcome)
+        self.reporter.result(result)
+        return result
+
+    def test(self, session, resource, title=None, fatal=None):
+        """Test single resource, returns Result
+
+        Resource not passing with `fatal` reason given cancels the run,
+        before its failure counts towards failures limit
+        """
+        title = title or session_title(session)
         try:
-            assertion.test(response)
-            self.result.succeed.append((response, None))
-            return self.result.succeed[-1]
-        except AssertionError as error:
-            self.result.failures.append((response, error))
-            return self.result.failures[-1]
-        # TODO: store vars in context
-
-    def request(self, **spec):
-        spec['url'] = urljoin(self.baseUri, spec['url'])
-        request = requests.Request(**spec)
-        prepared = request.prepare()
-        return self.session.send(prepared)
+            session.test(
+                resource, context=dict(self.context),
+                timeout=self.timeout, deadline=self.control.deadline, control=self.control
+            )
+            outcome, message = PASS, None
+        except ExpectError as failure:
+            outcome, message = FAIL, str(failure)
+        except Exception as error:
+            if isinstance(error, CancelledError) or self.control.cancelled:
+                # request interrupted by deadline
+                outcome, message = CANCELLED, self.control.reason or str(error)
+            else:
+                outcome, message = ERROR, str(error)
+        if fatal and outcome != PASS and not self.control.cancelled:
+            self.control.cancel('{}: {}: {}'.format(fatal, resource.title, message))
+        return self.record(Result(
+            title, resource.title, outcome, message, resource.elapsed, resource.response,
+            filename=session.filename
+        ))
+
+    def run_resources(self, session, resources, title=None, fatal=None):
+        """Test given resources of session one by one, returns their results"""
+        title = title or session_title(session)
+        if self.control.cancelled:
+            # whole session is skipped silently
+            return [
+                self.record(Result(title, resource.title, CANCELLED, filename=session.filename))
+                for resource in resources
+            ]
+        started = time.monotonic()
+        self.reporter.session_started(title)
+        results = []
+        for resource in resources:
+            if self.control.cancelled:
+                results.append(self.record(Result(title, resource.title, CANCELLED, filename=session.filename)))
+            else:
+                results.append(self.test(session, resource, title, fatal))
+        self.reporter.session_finished(title, time.monotonic() - started)
+        return results
+
+    def run_session(self, session):
+        if not session.resources:
+            # fixtures only session
+            return
+        skipped = self.control.cancelled
+        started = time.monotonic()
+        self.run_resources(session, session.resources)
+        if not skipped:
+            self.durations[session.filename] = time.monotonic() - started
+
+    def run(self, sessions):
+        for session in sessions:
+            self.run_session(session)
+        return self.totals
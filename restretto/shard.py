@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    Test sessions sharding for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sessions are split between shards balanced by durations recorded
+    on earlier runs, falling back to resource counts
+
+    Every shard of a run has to read the same timings: durations saved
+    by a finished shard change the partition of shards started after
+    it, so sessions would run twice or not at all. Parallel jobs should
+    start from the same copy of timings file
+"""
+
+import os
+
+from .utils import load_state, update_state
+
+
+DEFAULT_TIMINGS = '.restretto-timings.json'
+
+
+def key(session):
+    """Timings key of session, the same for ./tests/a.yml and tests/a.yml"""
+    return os.path.normpath(session.filename) if session.filename else None
+
+
+def load_timings(path):
+    """Return {session filename: duration} recorded in timings file"""
+    return {k: float(v) for (k, v) in load_state(path).items() if isinstance(v, (int, float))}
+
+
+def save_timings(path, durations):
+    """Merge session durations into timings file"""
+    def merge(timings):
+        timings.update((os.path.normpath(k), v) for (k, v) in durations.items() if k)
+        return timings
+    update_state(path, merge)
+
+
+def weights(sessions, timings):
+    """Estimate duration of every session
+
+    Sessions without recorded timing are weighted by resource count,
+    scaled by average duration of recorded resource when available
+    """
+    known = [s for s in sessions if key(s) in timings]
+    per_resource = 1.0
+    resources = sum(len(s.resources) for s in known)
+    if known and resources:
+        per_resource = sum(timings[key(s)] for s in known) / resources
+    return [
+        timings[key(s)] if key(s) in timings else len(s.resources) * per_resource
+        for s in sessions
+    ]
+
+
+def partition(sessions, total, timings=None):
+    """Split sessions into `total` shards with nearly equal estimated durations
+
+    Result is deterministic for the same sessions and timings: longest
+    sessions are placed first, each one into the least loaded shard
+    """
+    shards = [[] for _ in range(total)]
+    loads = [0.0] * total
+    order = sorted(
+        zip(weights(sessions, timings or {}), sessions),
+        key=lambda pair: (-pair[0], pair[1].filename or '')
+    )
+    for (weight, session) in order:
+        index = loads.index(min(loads))
+        shards[index].append(session)
+        loads[index] += weight
+    # keep original (loading) order inside shard
+    position = {id(s): n for (n, s) in enumerate(sessions)}
+    return [sorted(shard, key=lambda s: position[id(s)]) for shard in shards]
+
+
+def select(sessions, index, total, timings=None):
+    """Return sessions of shard `index` (1-based) out of `total`"""
+    return partition(sessions, total, timings)[index - 1]
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+    Snapshot (golden copy) assertions for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Response body is normalized and streamed through sha256, digest is
+    compared with the one recorded in snapshot file:
+
+        expect:
+          - snapshot: users-list
+            ignore: [json.meta.generated, json.items.*.updated]
+
+    Json bodies are normalized to sorted keys and fixed indentation,
+    with ignored paths left out, text bodies get unified line endings,
+    other ones are hashed as is. Snapshot file keeps digest on its first
+    line followed by normalized body, passing checks read the digest
+    only, recorded body is loaded to build diff on mismatch.
+
+    Snapshots are kept in DIRECTORY (relative to working directory, as
+    schema files are) and recorded with --update-snapshots
+"""
+
+import os
+import json
+import difflib
+import hashlib
+from fnmatch import fnmatchcase
+
+from .assertions import ResponseTest
+from .har import TEXT_TYPES
+from .utils import atomic_write
+
+
+DIRECTORY = 'snapshots'
+# record missing and mismatching snapshots instead of failing
+UPDATE = False
+
+EXTENSION = '.snap'
+# differences to report on mismatch
+MAX_DIFFS = 5
+
+
+def snapshot_path(name, directory=None):
+    return os.path.join(directory or DIRECTORY, '{}{}'.format(name, EXTENSION))
+
+
+def ignored(path, patterns):
+    """Whether path matches one of ignored paths, `*` matches any single key"""
+    return any(
+        len(pattern) == len(path) and all(fnmatchcase(key, p) for (key, p) in zip(path, pattern))
+        for pattern in patterns
+    )
+
+
+def encode(value, patterns=(), path=('json',), indent=''):
+    """Yield canonical json text of value in chunks, leaving ignored paths out"""
+    if isinstance(value, (dict, list)):
+        if isinstance(value, dict):
+            items = [(str(k), value[k]) for k in sorted(value, key=str)]
+            (opening, closing) = ('{', '}')
+        else:
+            items = [(str(n), item) for (n, item) in enumerate(value)]
+            (opening, closing) = ('[', ']')
+        items = [(k, v) for (k, v) in items if not ignored(path + (k,), patterns)]
+        if not items:
+            yield opening + closing
+            return
+        inner = indent + '  '
+        yield opening + '\n'
+        for (n, (key, item)) in enumerate(items):
+            yield inner + (json.dumps(key, ensure_ascii=False) + ': ' if isinstance(value, dict) else '')
+            yield from encode(item, patterns, path + (key,), inner)
+            yield ',\n' if n < len(items) - 1 else '\n'
+        yield indent + closing
+    else:
+        yield json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def normalize(response, patterns=()):
+    """Return (kind, chunks) of normalized response body"""
+    content_type = response.headers.get('Content-Type', '')
+    if 'json' in content_type:
+        try:
+            data = response.json()
+        except ValueError:
+            pass
+        else:
+            return ('json', (chunk.encode('utf-8') for chunk in encode(data, patterns)))
+    if any(t in content_type for t in TEXT_TYPES):
+        text = response.text.replace('\r\n', '\n')
+        return ('text', (text.encode('utf-8'),))
+    return ('binary', (response.content,))
+
+
+def parse_patterns(ignore):
+    if isinstance(ignore, str):
+        ignore = [ignore]
+    return tuple(tuple(str(p).split('.')) for p in ignore or ())
+
+
+def differences(kind, recorded, actual, limit=MAX_DIFFS):
+    """Describe first differences between recorded and actual normalized bodies"""
+    if kind == 'json':
+        diffs = []
+        compare(json.loads(recorded), json.loads(actual), 'json', diffs, limit)
+        return diffs
+    if kind == 'text':
+        lines = difflib.unified_diff(
+            recorded.decode('utf-8').splitlines(), actual.decode('utf-8').splitlines(),
+            'recorded', 'actual', lineterm='', n=0
+        )
+        return [line for line in lines if not line.startswith(('---', '+++'))][:limit]
+    return ['binary bodies differ ({} bytes recorded, {} received)'.format(len(recorded), len(actual))]
+
+
+def compare(recorded, actual, path, diffs, limit):
+    """Collect structural differences of json values"""
+    if len(diffs) >= limit:
+        return
+    if isinstance(recorded, dict) and isinstance(actual, dict):
+        for key in sorted(set(recorded) | set(actual)):
+            child = '{}.{}'.format(path, key)
+            if key not in actual:
+                diffs.append('{}: missing'.format(child))
+            elif key not in recorded:
+                diffs.append('{}: unexpected'.format(child))
+            else:
+                compare(recorded[key], actual[key], child, diffs, limit)
+            if len(diffs) >= limit:
+                return
+    elif isinstance(recorded, list) and isinstance(actual, list):
+        for (n, (one, other)) in enumerate(zip(recorded, actual)):
+            compare(one, other, '{}.{}'.format(path, n), diffs, limit)
+        if len(recorded) != len(actual) and len(diffs) < limit:
+            diffs.append('{}: length {} != {}'.format(path, len(actual), len(recorded)))
+    elif recorded != actual:
+        diffs.append('{}: {} != {}'.format(path, json.dumps(actual), json.dumps(recorded)))
+
+
+def read_digest(path):
+    """Return (digest, kind) recorded in snapshot file, reading its first line only"""
+    with open(path, 'rb') as source:
+        header = source.readline().decode('ascii').split()
+    return (header[0], header[1]) if len(header) == 2 else (None, None)
+
+
+def read_body(path):
+    with open(path, 'rb') as source:
+        source.readline()
+        return source.read()
+
+
+def write(path, kind, chunks):
+    """Record snapshot, hashing body while writing it"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    digest = hashlib.sha256()
+    with atomic_write(path, 'wb') as output:
+        # digest is written in place of the placeholder once body is hashed
+        output.write(b' ' * 80 + b'\n')
+        for chunk in chunks:
+            digest.update(chunk)
+            output.write(chunk)
+        output.seek(0)
+        output.write('sha256:{} {}'.format(digest.hexdigest(), kind).ljust(80).encode('ascii'))
+
+
+class SnapshotTest(ResponseTest):
+    """Compare normalized body digest with recorded snapshot"""
+
+    def __init__(self, name, ignore=None):
+        self.name = name
+        self.patterns = parse_patterns(ignore)
+
+    def test(self, response):
+        path = snapshot_path(self.name)
+        (recorded, recorded_kind) = read_digest(path) if os.path.exists(path) else (None, None)
+        (kind, chunks) = normalize(response, self.patterns)
+        digest = hashlib.sha256()
+        for chunk in chunks:
+            digest.update(chunk)
+        if recorded == 'sha256:{}'.format(digest.hexdigest()) and recorded_kind == kind:
+            return
+        if UPDATE:
+            write(path, *normalize(response, self.patterns))
+            return
+        self.expect(recorded, 'Snapshot not recorded: {} (use --update-snapshots to record it)'.format(path))
+        self.expect(recorded_kind == kind, 'Snapshot mismatch ({}): {} body recorded, {} received'.format(
+            self.name, recorded_kind, kind
+        ))
+        # mismatch is rare, body is normalized once again to build diff
+        actual = b''.join(normalize(response, self.patterns)[1])
+        self.expect(False, 'Snapshot mismatch ({}): {}'.format(
+            self.name, '; '.join(differences(kind, read_body(path), actual))
+        ))
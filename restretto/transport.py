@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+"""
+    HTTP transports for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sessions send requests through a transport chosen per run:
+
+    * requests - requests.Session, the default
+    * urllib3 - raw urllib3 pool manager, no per-request PreparedRequest
+    * asyncio - aiohttp client running on a background event loop
+      (requires aiohttp to be installed)
+
+    Every transport returns the same Response, so assertions and context
+    vars extraction do not depend on the backend
+"""
+
+import copy
+import time
+import zlib
+import socket
+import threading
+import weakref
+from collections.abc import MutableMapping
+from json import dumps, loads
+from http.cookies import SimpleCookie
+from os.path import basename
+from urllib.parse import urlencode
+
+from .errors import ExpectError, TransportError, RequestTimeout
+
+
+DEFAULT_TRANSPORT = 'requests'
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Headers(MutableMapping):
+    """Case-insensitive headers dict, keeping original names"""
+
+    def __init__(self, items=None):
+        self._store = {}
+        if items:
+            self.update(items)
+
+    def __setitem__(self, key, value):
+        self._store[key.lower()] = (key, value)
+
+    def __getitem__(self, key):
+        return self._store[key.lower()][1]
+
+    def __delitem__(self, key):
+        del self._store[key.lower()]
+
+    def __iter__(self):
+        return (key for (key, value) in self._store.values())
+
+    def __len__(self):
+        return len(self._store)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class RequestInfo(object):
+    """Request as it was sent"""
+
+    def __init__(self, method, url, headers, body=None):
+        self.method = method.upper()
+        self.url = url
+        self.headers = Headers(headers)
+        # encoded body, if known
+        self.body = body
+
+
+class Timer(object):
+    """Request phases timer"""
+
+    def __init__(self):
+        # wall clock time request has started at, epoch seconds
+        self.started = time.time()
+        self._start = self._last = time.monotonic()
+        self.phases = {}
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+
+class Response(object):
+    """Transport independent HTTP response"""
+
+    def __init__(self, status_code, reason, headers, content, url, transfer_size=None,
+                 request=None, timer=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = Headers(headers)
+        self.content = content
+        self.url = url
+        # bytes received over the wire (compressed) and decoded body bytes
+        self.transfer_size = transfer_size
+        self.body_size = len(content)
+        # decoded json body, shared by all assertions
+        self._json = None
+        # sent request and timings (wait for headers, receive body), if known
+        self.request = request
+        self.started = timer.started if timer else None
+        self.timings = dict(timer.phases) if timer else {}
+        # served by client side cache, transfer bytes it has saved
+        self.cached = False
+        self.saved = 0
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def encoding(self):
+        for param in self.headers.get('Content-Type', '').split(';')[1:]:
+            (key, _, value) = param.strip().partition('=')
+            if key.lower() == 'charset':
+                return value.strip('"\'') or 'utf-8'
+        return 'utf-8'
+
+    @property
+    def text(self):
+        try:
+            return self.content.decode(self.encoding, errors='replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        if self._json is None:
+            self._json = loads(self.text)
+        return self._json
+
+
+def read_stream(chunks, limit=None):
+    """Collect body chunks, aborting once size exceeds limit"""
+    body = bytearray()
+    for chunk in chunks:
+        body.extend(chunk)
+        if limit is not None and len(body) > limit:
+            raise ExpectError('Response body exceeds max_body ({} bytes)'.format(limit))
+    return bytes(body)
+
+
+def read_urllib3(raw, limit=None):
+    """Read urllib3 response body, returns (body, bytes received)"""
+    try:
+        body = read_stream(raw.stream(CHUNK_SIZE, decode_content=True), limit)
+    except Exception:
+        # drop connection instead of reading rest of the body
+        raw.close()
+        raise
+    raw.release_conn()
+    return (body, raw.tell())
+
+
+class Decoder(object):
+    """Incremental decoder of gzip/deflate content encodings"""
+
+    def __init__(self, encoding):
+        encoding = (encoding or '').strip().lower()
+        self.obj = None
+        if encoding == 'gzip':
+            self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.obj = zlib.decompressobj()
+        elif encoding not in ('', 'identity'):
+            raise TransportError('Unsupported content encoding: {}'.format(encoding))
+
+    def decode(self, chunk):
+        return self.obj.decompress(chunk) if self.obj else chunk
+
+    def flush(self):
+        return self.obj.flush() if self.obj else b''
+
+
+def with_params(url, params=None):
+    if not params:
+        return url
+    return '{}{}{}'.format(url, '&' if '?' in url else '?', urlencode(params, doseq=True))
+
+
+class ActiveConnections(object):
+    """Connections checked out of urllib3 pools, so requests in flight can be aborted"""
+
+    def __init__(self):
+        # connections dropped by pools are forgotten on their own
+        self.connections = weakref.WeakSet()
+        self.lock = threading.Lock()
+
+    def add(self, conn):
+        with self.lock:
+            self.connections.add(conn)
+
+    def discard(self, conn):
+        with self.lock:
+            self.connections.discard(conn)
+
+    def abort(self):
+        """Shut down sockets of all connections in use, waking up blocked readers"""
+        with self.lock:
+            connections = list(self.connections)
+        for conn in connections:
+            sock = getattr(conn, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def tracking_pools(pool_classes, active):
+    """urllib3 connection pool classes registering checked out connections in `active`"""
+    def track(cls):
+        def _get_conn(pool, timeout=None):
+            conn = cls._get_conn(pool, timeout)
+            active.add(conn)
+            return conn
+
+        def _put_conn(pool, conn):
+            # broken connections are put back as None
+            if conn is not None:
+                active.discard(conn)
+            return cls._put_conn(pool, conn)
+        return type(cls.__name__, (cls,), {'_get_conn': _get_conn, '_put_conn': _put_conn})
+    return {scheme: track(cls) for (scheme, cls) in pool_classes.items()}
+
+
+class Transport(object):
+    """Base transport: keeps common headers and tls verification flag"""
+
+    name = None
+
+    def __init__(self, headers=None, verify=False):
+        self.headers = Headers(headers)
+        self.verify = verify
+
+    def request(self, method, url, params=None, headers=None, data=None, json=None,
+                files=None, timeout=None, max_body=None):
+        """Send request, read whole body (up to max_body) and return Response"""
+        raise NotImplementedError
+
+    def update_headers(self, headers):
+        """Update headers sent with every request"""
+        self.headers.update(headers)
+
+    def fork(self):
+        """Return transport with own headers and cookies, sharing connection pools"""
+        raise NotImplementedError
+
+    def set_pool_size(self, size):
+        """Keep up to `size` connections per host for concurrent use"""
+        pass
+
+    def cancel(self):
+        """Abort requests in flight, called from other threads once run is cancelled
+
+        Connection pools are shared by forked transports, so requests
+        of all of them are aborted
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(Transport):
+    """requests.Session based transport"""
+
+    name = 'requests'
+
+    def __init__(self, headers=None, verify=False):
+        import requests
+        import urllib3
+        super().__init__(headers, verify)
+        self.requests = requests
+        self.urllib3 = urllib3
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.verify = verify
+        self.active = ActiveConnections()
+        self._track()
+        # forked transports do not own connection pools
+        self.shared = False
+
+    def _track(self):
+        for adapter in self.session.adapters.values():
+            manager = adapter.poolmanager
+            manager.pool_classes_by_scheme = tracking_pools(manager.pool_classes_by_scheme, self.active)
+
+    def request(self, method, url, timeout=None, max_body=None, **kwargs):
+        timer = Timer()
+        try:
+            response = self.session.request(method, url, timeout=timeout, stream=True, **kwargs)
+            timer.mark('wait')
+            # body is read from raw stream to account transferred bytes
+            (body, transfer_size) = read_urllib3(response.raw, max_body)
+            timer.mark('receive')
+        except (self.requests.Timeout, self.urllib3.exceptions.TimeoutError, TimeoutError) as error:
+            raise RequestTimeout(str(error)) from error
+        except (self.requests.RequestException, self.urllib3.exceptions.HTTPError) as error:
+            raise TransportError(str(error)) from error
+        sent = response.request
+        return Response(
+            response.status_code, response.reason, response.headers.items(),
+            body, response.url, transfer_size,
+            RequestInfo(sent.method, sent.url, sent.headers.items(), sent.body), timer
+        )
+
+    def update_headers(self, headers):
+        super().update_headers(headers)
+        self.session.headers.update(headers)
+
+    def fork(self):
+        forked = RequestsTransport.__new__(RequestsTransport)
+        Transport.__init__(forked, self.headers, self.verify)
+        (forked.requests, forked.urllib3, forked.active) = (self.requests, self.urllib3, self.active)
+        # copied session keeps adapters of this one, no new ones are mounted
+        forked.session = copy.copy(self.session)
+        forked.session.headers = self.requests.structures.CaseInsensitiveDict(self.session.headers)
+        forked.session.cookies = self.requests.cookies.cookiejar_from_dict({})
+        forked.shared = True
+        return forked
+
+    def set_pool_size(self, size):
+        for prefix in ('https://', 'http://'):
+            replaced = self.session.adapters.get(prefix)
+            self.session.mount(prefix, self.requests.adapters.HTTPAdapter(pool_maxsize=size))
+            if replaced is not None:
+                replaced.close()
+        self._track()
+
+    def cancel(self):
+        self.active.abort()
+
+    def close(self):
+        if not self.shared:
+            self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """Bare urllib3 pool manager transport
+
+    Request body is encoded directly, without building intermediate
+    request objects. Cookies are kept in a simple name/value store
+    regardless of their domain and path
+    """
+
+    name = 'urllib3'
+
+    def __init__(self, headers=None, verify=False):
+        import urllib3
+        super().__init__(headers, verify)
+        self.urllib3 = urllib3
+        self.headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        self.headers.setdefault('User-Agent', 'restretto')
+        self.cookies = {}
+        self.pool = urllib3.PoolManager(cert_reqs='CERT_REQUIRED' if verify else 'CERT_NONE')
+        self.active = ActiveConnections()
+        self.pool.pool_classes_by_scheme = tracking_pools(self.pool.pool_classes_by_scheme, self.active)
+        self.retries = urllib3.Retry(total=None, connect=0, read=0, status=0, redirect=30, raise_on_redirect=False)
+        # forked transports do not own connection pools
+        self.shared = False
+
+    def encode(self, headers, data=None, payload=None, files=None):
+        """Encode request body, setting content type header when known"""
+        if payload is not None:
+            headers.setdefault('Content-Type', 'application/json')
+            return dumps(payload).encode('utf-8')
+        if files:
+            fields = list((data or {}).items())
+            for (name, upload) in files:
+                fields.append((name, (basename(upload.name), upload.read())))
+            (body, content_type) = self.urllib3.encode_multipart_formdata(fields)
+            headers['Content-Type'] = content_type
+            return body
+        if isinstance(data, dict):
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+            return urlencode(data, doseq=True)
+        if isinstance(data, str):
+            return data.encode('utf-8')
+        return data
+
+    def request(self, method, url, params=None, headers=None, data=None, json=None,
+                files=None, timeout=None, max_body=None):
+        request_headers = Headers(self.headers)
+        request_headers.update(headers or {})
+        if self.cookies:
+            request_headers.setdefault(
+                'Cookie', '; '.join('{}={}'.format(k, v) for (k, v) in self.cookies.items())
+            )
+        body = self.encode(request_headers, data, json, files)
+        url = with_params(url, params)
+        timer = Timer()
+        try:
+            response = self.pool.urlopen(
+                method.upper(), url, body=body, headers=dict(request_headers),
+                timeout=self.urllib3.Timeout(connect=timeout, read=timeout),
+                retries=self.retries, preload_content=False, decode_content=True
+            )
+            timer.mark('wait')
+            (content, transfer_size) = read_urllib3(response, max_body)
+            timer.mark('receive')
+        except self.urllib3.exceptions.MaxRetryError as error:
+            # retries are disabled, report underlying error
+            if isinstance(error.reason, self.urllib3.exceptions.TimeoutError):
+                raise RequestTimeout(str(error.reason)) from error
+            raise TransportError(str(error.reason)) from error
+        except (self.urllib3.exceptions.TimeoutError, TimeoutError) as error:
+            raise RequestTimeout(str(error)) from error
+        except self.urllib3.exceptions.HTTPError as error:
+            raise TransportError(str(error)) from error
+        for header in response.headers.getlist('Set-Cookie'):
+            cookie = SimpleCookie()
+            cookie.load(header)
+            self.cookies.update((name, morsel.value) for (name, morsel) in cookie.items())
+        return Response(
+            response.status, response.reason, response.headers.items(),
+            content, response.url or url, transfer_size,
+            RequestInfo(method, url, request_headers.items(), body), timer
+        )
+
+    def fork(self):
+        forked = Urllib3Transport.__new__(Urllib3Transport)
+        Transport.__init__(forked, self.headers, self.verify)
+        (forked.urllib3, forked.pool, forked.retries) = (self.urllib3, self.pool, self.retries)
+        forked.active = self.active
+        forked.cookies = {}
+        forked.shared = True
+        return forked
+
+    def set_pool_size(self, size):
+        self.pool.connection_pool_kw['maxsize'] = size
+        self.pool.clear()
+
+    def cancel(self):
+        self.active.abort()
+
+    def close(self):
+        if not self.shared:
+            self.pool.clear()
+
+
+class EventLoop(object):
+    """Event loop running in background daemon thread, shared by async transports"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        import asyncio
+        self.asyncio = asyncio
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def shared(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def run(self, coroutine):
+        """Run coroutine on the loop from any other thread, wait for result"""
+        return self.submit(coroutine).result()
+
+    def submit(self, coroutine):
+        """Schedule coroutine on the loop from any other thread, returns its future"""
+        return self.asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+class AsyncioTransport(Transport):
+    """aiohttp based transport
+
+    Requests are executed on shared background event loop, so transport
+    may be used both from synchronous code with request() and from
+    coroutines running on that loop with arequest()
+    """
+
+    name = 'asyncio'
+
+    def __init__(self, headers=None, verify=False):
+        try:
+            import aiohttp
+        except ImportError:
+            raise TransportError('asyncio transport requires aiohttp to be installed')
+        super().__init__(headers, verify)
+        self.aiohttp = aiohttp
+        self.headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        self.events = EventLoop.shared()
+        self.client = self.events.run(self._open())
+        # futures of requests in flight, shared by forked transports
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    async def _open(self, connector=None):
+        return self.aiohttp.ClientSession(
+            connector=connector or self.aiohttp.TCPConnector(ssl=None if self.verify else False),
+            # forked transports do not own connection pools
+            connector_owner=connector is None,
+            cookie_jar=self.aiohttp.CookieJar(unsafe=True),
+            # body is decoded by transport to account transferred bytes
+            auto_decompress=False
+        )
+
+    def fork(self):
+        forked = AsyncioTransport.__new__(AsyncioTransport)
+        Transport.__init__(forked, self.headers, self.verify)
+        (forked.aiohttp, forked.events) = (self.aiohttp, self.events)
+        (forked.pending, forked.lock) = (self.pending, self.lock)
+        forked.client = self.events.run(forked._open(self.client.connector))
+        return forked
+
+    def form(self, data=None, files=None):
+        form = self.aiohttp.FormData()
+        for (name, value) in (data or {}).items():
+            form.add_field(name, str(value))
+        for (name, upload) in files:
+            form.add_field(name, upload, filename=basename(upload.name))
+        return form
+
+    async def arequest(self, method, url, params=None, headers=None, data=None, json=None,
+                       files=None, timeout=None, max_body=None):
+        if files:
+            data = self.form(data, files)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        request_headers = Headers(self.headers)
+        request_headers.update(headers or {})
+        timer = Timer()
+        try:
+            async with self.client.request(
+                method.upper(), url, params=params, headers=dict(request_headers), data=data, json=json,
+                timeout=self.aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+            ) as response:
+                timer.mark('wait')
+                decoder = Decoder(response.headers.get('Content-Encoding'))
+                body = bytearray()
+                transfer_size = 0
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    transfer_size += len(chunk)
+                    body.extend(decoder.decode(chunk))
+                    if max_body is not None and len(body) > max_body:
+                        raise ExpectError('Response body exceeds max_body ({} bytes)'.format(max_body))
+                body.extend(decoder.flush())
+                timer.mark('receive')
+        except self.events.asyncio.TimeoutError as error:
+            raise RequestTimeout('Request timed out ({} seconds)'.format(timeout)) from error
+        except self.aiohttp.ClientError as error:
+            raise TransportError(str(error)) from error
+        sent = response.request_info
+        if json is not None:
+            data = dumps(json).encode('utf-8')
+        return Response(
+            response.status, response.reason, response.headers.items(),
+            bytes(body), str(response.url), transfer_size,
+            RequestInfo(sent.method, str(sent.url), sent.headers.items(),
+                        data if isinstance(data, bytes) else None), timer
+        )
+
+    def request(self, *args, **kwargs):
+        future = self.events.submit(self.arequest(*args, **kwargs))
+        with self.lock:
+            self.pending.add(future)
+        try:
+            return future.result()
+        except Exception as error:
+            if future.cancelled():
+                raise TransportError('Request aborted') from error
+            raise
+        finally:
+            with self.lock:
+                self.pending.discard(future)
+
+    def cancel(self):
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+
+    def close(self):
+        if not self.client.closed:
+            self.events.run(self.client.close())
+
+
+TRANSPORTS = {
+    transport.name: transport
+    for transport in (RequestsTransport, Urllib3Transport, AsyncioTransport)
+}
+
+
+def get_transport(name=None):
+    """Return transport class by name"""
+    name = name or DEFAULT_TRANSPORT
+    if name not in TRANSPORTS:
+        raise ValueError('Unknown transport: {}'.format(name))
+    return TRANSPORTS[name]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    Virtual users for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Loaded sessions are run as a scenario by N concurrent virtual users.
+    Every user gets forked sessions with own context, extracted vars,
+    cookies and headers, while connection pools, parsed resources and
+    compiled templates are shared by all of them. Users are started
+    evenly during ramp-up and pause for think time after every resource
+
+    Every user runs in its own thread, blocked while waiting for
+    responses, so a run is practical up to a few hundreds of users;
+    the asyncio transport saves connections, not threads
+"""
+
+import random
+import threading
+import time
+
+from .control import Control
+from .metrics import Metrics
+from .probe import MetricsReporter
+from .runner import Runner, Reporter, Totals
+
+
+class UserRunner(Runner):
+    """Runner of single virtual user, thinking after every resource"""
+
+    def __init__(self, user, think_time=(0, 0), **kwargs):
+        super().__init__(**kwargs)
+        self.user = user
+        # (min, max) seconds
+        self.think_time = think_time
+
+    def test(self, session, resource, title=None, fatal=None):
+        result = super().test(session, resource, title, fatal)
+        (low, high) = self.think_time
+        if high > 0:
+            self.control.sleep(random.uniform(low, high))
+        return result
+
+
+class VirtualUsers(object):
+    """Run sessions by concurrent virtual users, collecting merged totals and metrics"""
+
+    def __init__(self, sessions, users, ramp_up=0, think_time=(0, 0), context=None, timeout=None,
+                 control=None, reporter=None, metrics=None):
+        self.sessions = sessions
+        self.users = users
+        # seconds to start all users in
+        self.ramp_up = ramp_up
+        self.think_time = think_time
+        self.context = context or {}
+        self.timeout = timeout
+        self.control = control or Control()
+        self.metrics = metrics or Metrics()
+        self.reporter = MetricsReporter(self.metrics, reporter or Reporter())
+        self.totals = Totals()
+        self.lock = threading.Lock()
+        # users started and finished so far
+        self.started = 0
+        self.finished = 0
+        self.duration = None
+
+    def user(self, number):
+        """Run whole scenario as single user"""
+        sessions = [session.fork() for session in self.sessions]
+        runner = UserRunner(
+            number, self.think_time, context=dict(self.context), timeout=self.timeout,
+            control=self.control, reporter=self.reporter
+        )
+        try:
+            runner.run(sessions)
+        finally:
+            for session in sessions:
+                session.close()
+            with self.lock:
+                self.totals.merge(runner.totals)
+                self.finished += 1
+
+    def run(self):
+        """Start users during ramp-up and wait for all of them, returns totals"""
+        for session in self.sessions:
+            # every user may keep a connection to the same host
+            session.http.set_pool_size(self.users)
+            # forks share connections in use with their base session, so
+            # one hook aborts requests of all users waiting for response
+            self.control.on_cancel(session.http.cancel)
+        started = time.monotonic()
+        threads = []
+        for number in range(self.users):
+            if number and self.ramp_up:
+                delay = started + self.ramp_up * number / self.users - time.monotonic()
+                if delay > 0 and not self.control.sleep(delay):
+                    break
+            if self.control.cancelled:
+                break
+            thread = threading.Thread(target=self.user, args=(number + 1,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            self.started += 1
+        for thread in threads:
+            thread.join()
+        self.duration = time.monotonic() - started
+        return self.totals
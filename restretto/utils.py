@@ -2,8 +2,18 @@
 # -*- coding: utf-8 -*-
 
 
-import yaml
-from jinja2 import Template
+import os
+import re
+import json
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def compile_template(src):
+    """Compile template once, spec strings are reused on every run"""
+    from jinja2 import Template
+    return Template(src)
 
 
 def apply_context(src, context={}):
@@ -21,7 +31,8 @@ def apply_context(src, context={}):
             result.append(apply_context(item, context))
     elif type(src) is str and "{{" in src:
         #just apply template if string contains var
-        result = yaml.full_load(Template(src).render(context))
+        import yaml
+        result = yaml.full_load(compile_template(src).render(context))
     else:
         # integers/boolean and other non-templatable types
         result = src
@@ -36,3 +47,81 @@ def json_path(path, data):
         src = src[int(p)] if (isinstance(src, list) and p.isdigit()) \
             else src.get(p, {})
     return src
+
+
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+
+def parse_size(value):
+    """Convert size like 512, "50KB" or "1.5 MB" to bytes"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*$', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError('Bad size value: {}'.format(value))
+    (number, unit) = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper().rstrip('B') + 'B' if unit else ''])
+
+
+@contextmanager
+def atomic_write(path, mode='w', permissions=0o644):
+    """Write file aside and move it into place, so readers never see partial data
+
+    Temporary file is unique, so concurrent writers do not clash
+    """
+    import tempfile
+    (fd, tmp) = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix='.{}.'.format(os.path.basename(path)), suffix='.tmp'
+    )
+    try:
+        os.chmod(tmp, permissions)
+        with os.fdopen(fd, mode) as output:
+            yield output
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+@contextmanager
+def locked(path):
+    """Hold exclusive lock of `path`, shared by processes updating it"""
+    try:
+        import fcntl
+    except ImportError:
+        # no advisory locks on this platform, last writer wins
+        yield
+        return
+    with open('{}.lock'.format(path), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_state(path):
+    """Return dict saved in json state file, empty one when it is missing or broken"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as source:
+            data = json.load(source)
+    except ValueError:
+        # broken state file should not break the run
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def update_state(path, update, permissions=0o644):
+    """Replace json state file with update(current state), returns new state
+
+    State is read and written under lock, so concurrent runs (like
+    parallel shards) merge their changes instead of dropping them
+    """
+    with locked(path):
+        state = update(load_state(path))
+        with atomic_write(path, permissions=permissions) as output:
+            json.dump(state, output, indent=2, sort_keys=True, default=str)
+    return state
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+    Watch mode for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sessions stay loaded between runs, forking their transports from
+    long living ones, so connection pools stay warm. Test files and var
+    files they include are watched (with inotify on Linux, by polling
+    modification times elsewhere), changed files are parsed again and
+    only affected sessions are run: sessions whose own file changed
+    and ones including changed var file
+"""
+
+import os
+import select
+import struct
+import time
+
+from .loader import find_files, load_spec
+from .rest import Session
+from .transport import get_transport
+
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event header: wd, mask, cookie, len
+EVENT = struct.Struct('iIII')
+
+# seconds to keep collecting changes after the first one, editors save in steps
+SETTLE = 0.1
+
+
+def stat(path):
+    """Return (mtime, size) of file, None when it is missing"""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+
+class PollingWatcher(object):
+    """Detect changes by comparing modification times and sizes of files"""
+
+    name = 'polling'
+
+    def __init__(self, files, interval=0.5):
+        # callable returning paths to watch, new files are picked up on every poll
+        self.files = files
+        self.interval = interval
+        self.state = self.scan(())
+
+    def scan(self, known):
+        return {path: stat(path) for path in set(self.files()) | set(known)}
+
+    def wait(self, timeout=None):
+        """Block till some files change, returns their paths (empty set on timeout)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self.scan(self.state)
+            changed = {path for (path, info) in current.items() if self.state.get(path) != info}
+            self.state = {path: info for (path, info) in current.items() if info is not None}
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Detect changes with Linux inotify, watching directories files are in
+
+    Directories are watched instead of files, so files replaced by
+    editors (written aside and renamed) and new files are noticed too
+    """
+
+    name = 'inotify'
+
+    def __init__(self, files, roots=()):
+        import ctypes
+        import ctypes.util
+        self.files = files
+        self.roots = roots
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # watch descriptor -> directory
+        self.watches = {}
+        self.refresh()
+
+    def refresh(self):
+        """Watch directories of watched files and every directory under roots"""
+        directories = {os.path.dirname(path) or '.' for path in self.files()}
+        for root in self.roots:
+            if os.path.isdir(root):
+                directories.update(curdir for (curdir, _, _) in os.walk(root, followlinks=True))
+        for directory in directories - set(self.watches.values()):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = directory
+
+    def read(self, timeout):
+        """Return paths of events received within timeout"""
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            (wd, mask, _, length) = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_IGNORED:
+                # directory was removed
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # files may have been written before new directory got watched
+                self.refresh()
+                changed.update(find_files(path) if os.path.isdir(path) else ())
+            else:
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """Block till some files change, returns their paths (empty set on timeout)"""
+        self.refresh()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = set()
+        while not changed:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return changed
+            changed = self.read(remaining)
+        while True:
+            more = self.read(SETTLE)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watcher(files, roots=(), interval=0.5):
+    """Return inotify watcher when available, polling one otherwise"""
+    try:
+        return InotifyWatcher(files, roots)
+    except (OSError, AttributeError):
+        # not Linux or no usable libc
+        return PollingWatcher(files, interval)
+
+
+class Watch(object):
+    """Sessions loaded from path, kept in memory and reloaded when their files change"""
+
+    def __init__(self, path, transport=None, cache=None):
+        self.path = path
+        self.transport = transport
+        self.cache = cache
+        # long living transports, keyed by verify, sessions fork connection pools from
+        self.pools = {}
+        # absolute path of session file -> Session
+        self.sessions = {}
+        # absolute path of session file -> message, for files failed to load
+        self.errors = {}
+        # absolute path of var file -> session files including it
+        self.dependants = {}
+
+    def pool(self, spec):
+        verify = spec.get('verify', False)
+        if verify not in self.pools:
+            self.pools[verify] = get_transport(self.transport)(verify=verify)
+        return self.pools[verify]
+
+    def files(self):
+        """Absolute paths of test files and var files they include"""
+        files = {os.path.abspath(entry) for entry in find_files(self.path)}
+        files.update(self.dependants)
+        return files
+
+    def load_file(self, entry):
+        """(Re)load session from file, returns None for empty and broken files"""
+        key = os.path.abspath(entry)
+        self.remove(key, keep_dependencies=True)
+        try:
+            spec = load_spec(entry)
+            session = Session(spec, transport=self.transport, cache=self.cache, pool=self.pool(spec)) \
+                if spec else None
+        except Exception as error:
+            # dependencies of broken file are kept, so fixing var file reloads it
+            self.errors[key] = '{}: {}'.format(type(error).__name__, error)
+            return None
+        for dependants in self.dependants.values():
+            dependants.discard(key)
+        for var_file in spec.get('var_files', []) if spec else []:
+            self.dependants.setdefault(os.path.abspath(var_file), set()).add(key)
+        if not session:
+            return None
+        self.sessions[key] = session
+        return session
+
+    def remove(self, key, keep_dependencies=False):
+        session = self.sessions.pop(key, None)
+        if session is not None:
+            session.close()
+        self.errors.pop(key, None)
+        if not keep_dependencies:
+            for dependants in self.dependants.values():
+                dependants.discard(key)
+
+    def load(self):
+        """Load all sessions found at path"""
+        loaded = [self.load_file(entry) for entry in find_files(self.path)]
+        return [session for session in loaded if session]
+
+    def affected(self, changed, present):
+        """Absolute paths of session files affected by changed paths"""
+        affected = set()
+        for path in changed:
+            path = os.path.abspath(path)
+            if path in present or path in self.sessions or path in self.errors:
+                affected.add(path)
+            affected.update(self.dependants.get(path, ()))
+        return affected
+
+    def reload(self, changed):
+        """Reload sessions affected by changed paths, returns ones to run again
+
+        Returns None when changes do not affect any session file
+        """
+        found = find_files(self.path)
+        present = {os.path.abspath(entry) for entry in found}
+        affected = self.affected(changed, present)
+        if not affected:
+            return None
+        for key in affected - present:
+            self.remove(key)
+        reloaded = [self.load_file(entry) for entry in found if os.path.abspath(entry) in affected]
+        return [session for session in reloaded if session]
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        for pool in self.pools.values():
+            pool.close()
+        self.pools.clear()
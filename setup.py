@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import re
 from setuptools import find_packages, setup
 
+with open("restretto/__init__.py") as source:
+    version = re.search(r'^__version__ = "(.+)"$', source.read(), re.M).group(1)
+
 setup(
     name="restretto",
-    version="1.0.4",
+    version=version,
     description="restretto is REST API testing tool",
     long_description="YML-scenario based REST API testing tool",
     author="Arthur Orlov",
@@ -14,6 +18,7 @@ setup(
     packages=find_packages(),
     entry_points={"console_scripts": ["restretto = restretto.cli:main"]},
     install_requires=["requests>=2.7.0", "pyaml>=3.11", "jinja2>=2.8", "clint>=0.5"],
+    extras_require={"asyncio": ["aiohttp>=3.0"], "schema": ["jsonschema>=3.0"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",
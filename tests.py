@@ -4,9 +4,150 @@
     Unittests for restretto
 """
 
+import gzip
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import restretto
 import restretto.cli
+import restretto.control
+import restretto.distributed
+import restretto.fixtures
+import restretto.har
+import restretto.history
+import restretto.lastrun
+import restretto.loader
+import restretto.metrics
+import restretto.probe
+import restretto.runner
+import restretto.shard
+import restretto.snapshot
+import restretto.transport
+import restretto.users
+import restretto.watch
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """Minimal httpbin-like handler for local tests"""
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        status = 200
+        if path.startswith('/status/'):
+            status = int(path.rsplit('/', 1)[-1])
+        elif path.startswith('/delay/'):
+            time.sleep(float(path.rsplit('/', 1)[-1]))
+        body = json.dumps({
+            'path': self.path, 'token': 'abc', 'cookie': self.headers.get('Cookie')
+        }).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if path == '/set-cookie':
+            headers['Set-Cookie'] = 'sid=s3cr3t; Path=/'
+        elif path.startswith('/bytes/'):
+            body = b'a' * int(path.rsplit('/', 1)[-1])
+            headers = {'Content-Type': 'text/plain'}
+        elif path.startswith('/gzip/'):
+            body = gzip.compress(b'a' * int(path.rsplit('/', 1)[-1]))
+            headers = {'Content-Type': 'text/plain', 'Content-Encoding': 'gzip'}
+        elif path.startswith('/etag/'):
+            etag = '"{}"'.format(path.rsplit('/', 1)[-1])
+            headers.update({'ETag': etag, 'Cache-Control': 'no-cache'})
+            if self.headers.get('If-None-Match') == etag:
+                (status, body) = (304, b'')
+        elif path.startswith('/cache/'):
+            headers['Cache-Control'] = 'max-age={}'.format(path.rsplit('/', 1)[-1])
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length).decode('utf-8')
+        body = json.dumps({
+            'path': self.path, 'data': data, 'content_type': self.headers.get('Content-Type')
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients dropping connections on purpose are expected
+        pass
+
+
+class LocalServerMixin(object):
+    """Run local http server for the whole test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer(('127.0.0.1', 0), LocalHandler)
+        cls.base_uri = 'http://127.0.0.1:{}/'.format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    transport = None
+
+    def session(self, *resources, **spec):
+        spec.setdefault('title', 'Local')
+        spec.setdefault('baseUri', self.base_uri)
+        spec['resources'] = list(resources)
+        session = restretto.Session(spec, transport=self.transport)
+        self.addCleanup(session.close)
+        return session
+
+
+class TempDirMixin(object):
+    """Give every test its own temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def temp_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, text):
+        path = self.temp_path(name)
+        with open(path, 'w') as output:
+            output.write(text)
+        return path
 
 
 class ResourceTestCase(unittest.TestCase):
@@ -220,6 +361,46 @@ class AssertsTestCase(unittest.TestCase):
         with self.assertRaises(restretto.errors.ExpectError):
             assertion.test(resp)
 
+    def test_schema(self):
+        spec = [{'schema': 'test-data/schemas/token.json'}]
+        assertion = restretto.assertions.Assert(spec)
+        resp = self.Response(200, json=lambda: {'token': 'abc', 'path': '/'})
+        self.assertTrue(assertion.test(resp))
+        resp = self.Response(200, json=lambda: {'token': 1})
+        with self.assertRaisesRegex(restretto.errors.ExpectError, 'path.*required.*token: 1'):
+            assertion.test(resp)
+
+    def test_schema_yaml(self):
+        assertion = restretto.assertions.Assert([{'schema': 'test-data/schemas/items.yml'}])
+        self.assertTrue(assertion.test(self.Response(200, json=lambda: [1, 2])))
+        with self.assertRaises(restretto.errors.ExpectError):
+            assertion.test(self.Response(200, json=lambda: [1, 'two']))
+
+    def test_schema_not_json(self):
+        def broken():
+            raise ValueError('not json')
+        assertion = restretto.assertions.Assert([{'schema': 'test-data/schemas/token.json'}])
+        with self.assertRaises(restretto.errors.ExpectError):
+            assertion.test(self.Response(200, json=broken))
+
+    def test_schema_compiled_once(self):
+        one = restretto.assertions.compile_schema('test-data/schemas/token.json')
+        other = restretto.assertions.compile_schema('./test-data/schemas/token.json')
+        self.assertIs(one, other)
+
+    def test_parse_size(self):
+        parse_size = restretto.utils.parse_size
+        self.assertEqual(parse_size(10), 10)
+        self.assertEqual(parse_size('50KB'), 50 * 1024)
+        self.assertEqual(parse_size('1.5 mb'), 3 * 512 * 1024)
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+    def test_size_unknown(self):
+        assertion = restretto.assertions.Assert([{'size': 'transfer', 'max': 10}])
+        with self.assertRaises(restretto.errors.ExpectError):
+            assertion.test(self.Response(200))
+
 
 class TemplatingTestCase(unittest.TestCase):
 
@@ -372,10 +553,1118 @@ class OptionsTestCase(unittest.TestCase):
         with self.assertRaises(restretto.cli.ArgumentTypeError):
             restretto.cli.options("=value")
 
+    def test_address(self):
+        self.assertEqual(restretto.cli.address("example.com:80"), ("example.com", 80))
+        self.assertEqual(restretto.cli.address(":0"), ("127.0.0.1", 0))
+        with self.assertRaises(restretto.cli.ArgumentTypeError):
+            restretto.cli.address("example.com")
+
+    def test_think_time(self):
+        self.assertEqual(restretto.cli.think_time("1"), (1.0, 1.0))
+        self.assertEqual(restretto.cli.think_time("0.5-2"), (0.5, 2.0))
+        with self.assertRaises(restretto.cli.ArgumentTypeError):
+            restretto.cli.think_time("2-1")
+
     def test_convert_empty_keyval(self):
         with self.assertRaises(restretto.cli.ArgumentTypeError):
             restretto.cli.options(" = ")
 
 
+class MetricsTestCase(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = restretto.metrics.Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertEqual(histogram.count, 4)
+
+    def test_histogram_merge(self):
+        one = restretto.metrics.Histogram((1.0,))
+        other = restretto.metrics.Histogram((1.0,))
+        one.observe(0.5)
+        other.observe(2)
+        one.merge(other)
+        self.assertEqual(one.counts, [1, 1])
+        with self.assertRaises(ValueError):
+            one.merge(restretto.metrics.Histogram((2.0,)))
+
+    def test_render(self):
+        metrics = restretto.metrics.Metrics(buckets=(1.0,))
+        metrics.record('Sess "1"', 'GET /', 'pass', 0.5)
+        metrics.record('Sess "1"', 'GET /', 'fail', 2.0)
+        text = metrics.render()
+        self.assertTrue(text.endswith('# EOF\n'))
+        self.assertIn('restretto_resource_success{session="Sess \\"1\\"",resource="GET /"} 0', text)
+        self.assertIn('restretto_resource_tests_total{session="Sess \\"1\\"",resource="GET /",outcome="fail"} 1', text)
+        self.assertIn('le="+Inf"} 2', text)
+
+    def test_render_cache(self):
+        metrics = restretto.metrics.Metrics()
+        metrics.record('S', 'GET /', 'pass', 0.1)
+        metrics.record('S', 'GET /', 'pass', 0.1, cached=True, saved=120)
+        text = metrics.render()
+        self.assertIn('restretto_resource_cache_hits_total{session="S",resource="GET /"} 1', text)
+        self.assertIn('restretto_resource_cache_saved_bytes_total{session="S",resource="GET /"} 120', text)
+
+
+class ProbeTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_repeated_iterations(self):
+        session = self.session('/get', {'get': '/status/500', 'title': 'broken'})
+        prober = restretto.probe.Probe([session], interval=0)
+        prober.run(iterations=3)
+        stats = prober.metrics.resources[('Local', 'get /get')]
+        self.assertEqual(stats.outcomes['pass'], 3)
+        self.assertEqual(stats.latency.count, 3)
+        stats = prober.metrics.resources[('Local', 'broken')]
+        self.assertEqual(stats.outcomes['fail'], 3)
+
+    def test_vars_kept_between_iterations(self):
+        session = self.session({'get': '/get', 'vars': {'token': 'json.token'}}, '/get?t={{token}}')
+        prober = restretto.probe.Probe([session], interval=0)
+        prober.run(iterations=2)
+        self.assertEqual(session.context['token'], 'abc')
+        self.assertEqual(session.resources[1].response.json()['path'], '/get?t=abc')
+
+    def test_metrics_server(self):
+        from urllib.request import urlopen
+        metrics = restretto.metrics.Metrics()
+        metrics.record('s', 'r', 'pass', 0.1)
+        server = restretto.probe.MetricsServer(metrics).start()
+        try:
+            with urlopen('http://127.0.0.1:{}/metrics'.format(server.port)) as response:
+                self.assertIn('openmetrics-text', response.headers['Content-Type'])
+                self.assertIn('restretto_resource_success', response.read().decode('utf-8'))
+        finally:
+            server.stop()
+
+
+class ShardTestCase(TempDirMixin, unittest.TestCase):
+
+    def sessions(self, *sizes):
+        return [
+            restretto.Session({'filename': 's{}.yml'.format(n), 'resources': ['/'] * size})
+            for (n, size) in enumerate(sizes)
+        ]
+
+    def test_parse_shard(self):
+        self.assertEqual(restretto.cli.shard("2/3"), (2, 3))
+        for bad in ("0/3", "4/3", "1", "a/b"):
+            with self.assertRaises(restretto.cli.ArgumentTypeError):
+                restretto.cli.shard(bad)
+
+    def test_partition_covers_all(self):
+        sessions = self.sessions(5, 1, 3, 2, 2, 1)
+        shards = restretto.shard.partition(sessions, 3)
+        flat = [s for shard in shards for s in shard]
+        self.assertEqual(sorted(s.filename for s in flat), sorted(s.filename for s in sessions))
+        self.assertEqual([sum(len(s.resources) for s in shard) for shard in shards], [5, 5, 4])
+
+    def test_partition_deterministic(self):
+        sessions = self.sessions(1, 1, 1, 1)
+        first = restretto.shard.select(sessions, 1, 2)
+        second = restretto.shard.select(list(reversed(sessions)), 1, 2)
+        self.assertEqual([s.filename for s in first], sorted(s.filename for s in second))
+
+    def test_partition_by_timings(self):
+        sessions = self.sessions(1, 1, 1)
+        timings = {'s0.yml': 10.0, 's1.yml': 1.0}
+        shards = restretto.shard.partition(sessions, 2, timings)
+        self.assertEqual([s.filename for s in shards[0]], ['s0.yml'])
+        self.assertEqual([s.filename for s in shards[1]], ['s1.yml', 's2.yml'])
+
+    def test_timings_file(self):
+        path = self.temp_path('timings.json')
+        self.assertEqual(restretto.shard.load_timings(path), {})
+        restretto.shard.save_timings(path, {'a.yml': 1.5})
+        restretto.shard.save_timings(path, {'./b.yml': 2})
+        self.assertEqual(restretto.shard.load_timings(path), {'a.yml': 1.5, 'b.yml': 2.0})
+        self.write('timings.json', '[1, 2]')
+        self.assertEqual(restretto.shard.load_timings(path), {})
+
+    def test_parallel_shards(self):
+        path = self.temp_path('timings.json')
+        threads = [
+            threading.Thread(target=restretto.shard.save_timings, args=(path, {'s{}.yml'.format(n): n}))
+            for n in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(restretto.shard.load_timings(path)), 20)
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.tmp')], [])
+
+    def test_normalized_keys(self):
+        sessions = self.sessions(1, 1)
+        sessions[0].spec['filename'] = './s0.yml'
+        weights = restretto.shard.weights(sessions, {'s0.yml': 10.0})
+        self.assertEqual(weights, [10.0, 10.0])
+
+
+class TimeoutTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_resource_timeout(self):
+        session = self.session({'get': '/delay/1', 'timeout': 0.1})
+        with self.assertRaises(restretto.errors.RequestTimeout):
+            session.test(session.resources[0])
+
+    def test_session_timeout_overrides_default(self):
+        session = self.session({'get': '/delay/1'}, timeout=0.1)
+        with self.assertRaises(restretto.errors.RequestTimeout):
+            session.test(session.resources[0], timeout=5)
+
+    def test_deadline_caps_timeout(self):
+        session = self.session({'get': '/delay/1'})
+        started = time.monotonic()
+        with self.assertRaises(restretto.errors.RequestTimeout):
+            session.test(session.resources[0], deadline=time.monotonic() + 0.1)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_deadline_exceeded(self):
+        session = self.session('/get', {'wait': 1})
+        with self.assertRaises(restretto.errors.CancelledError):
+            session.test(session.resources[0], deadline=time.monotonic() - 1)
+        with self.assertRaises(restretto.errors.CancelledError):
+            session.test(session.resources[1], deadline=time.monotonic() + 0.05)
+
+
+class TransferTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_plain_sizes(self):
+        session = self.session('/bytes/1000')
+        response = session.test(session.resources[0]).response
+        self.assertEqual(response.transfer_size, 1000)
+        self.assertEqual(response.body_size, 1000)
+        self.assertEqual(len(response.text), 1000)
+
+    def test_compressed_sizes(self):
+        session = self.session('/gzip/100000')
+        response = session.test(session.resources[0]).response
+        self.assertLess(response.transfer_size, 1000)
+        self.assertEqual(response.body_size, 100000)
+        self.assertEqual(response.content, b'a' * 100000)
+
+    def test_max_body(self):
+        session = self.session({'get': '/bytes/300000', 'max_body': '100KB'}, '/get')
+        with self.assertRaises(restretto.errors.ExpectError):
+            session.test(session.resources[0])
+        self.assertIsNone(session.resources[0].response)
+        # connection pool is still usable
+        session.test(session.resources[1])
+
+    def test_session_max_body(self):
+        session = self.session('/gzip/300000', max_body='100KB')
+        with self.assertRaises(restretto.errors.ExpectError):
+            session.test(session.resources[0])
+
+    def test_size_assertions(self):
+        session = self.session({
+            'get': '/gzip/100000',
+            'expect': [{'size': 'transfer', 'max': '1KB'}, {'size': 'body', 'min': '90KB'}]
+        }, {
+            'get': '/bytes/100000',
+            'expect': [{'size': 'transfer', 'max': '50KB'}]
+        })
+        session.test(session.resources[0])
+        with self.assertRaises(restretto.errors.ExpectError):
+            session.test(session.resources[1])
+
+
+class TransportTestCase(LocalServerMixin, unittest.TestCase):
+    """Common behaviour of transports, requests one by default"""
+
+    def test_get_json(self):
+        session = self.session({
+            'get': '/get', 'params': {'q': 'x y'},
+            'expect': [{'header': 'content-type', 'is': 'application/json'}]
+        })
+        response = session.test(session.resources[0]).response
+        self.assertEqual(response.json()['path'], '/get?q=x+y')
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_payloads(self):
+        session = self.session(
+            {'post': '/post', 'json': {'a': 1}},
+            {'post': '/post', 'data': {'a': 'b'}},
+            {'post': '/post', 'data': 'raw text'}
+        )
+        sent = [session.test(r).response.json() for r in session.resources]
+        self.assertEqual(json.loads(sent[0]['data']), {'a': 1})
+        self.assertEqual(sent[0]['content_type'], 'application/json')
+        self.assertEqual(sent[1]['data'], 'a=b')
+        self.assertEqual(sent[2]['data'], 'raw text')
+
+    def test_cookies(self):
+        session = self.session('/set-cookie', '/get')
+        session.test(session.resources[0])
+        response = session.test(session.resources[1]).response
+        self.assertEqual(response.json()['cookie'], 'sid=s3cr3t')
+
+    def test_compressed(self):
+        session = self.session('/gzip/100000', {'get': '/bytes/300000', 'max_body': 1000})
+        response = session.test(session.resources[0]).response
+        self.assertEqual(response.body_size, 100000)
+        self.assertLess(response.transfer_size, 1000)
+        with self.assertRaises(restretto.errors.ExpectError):
+            session.test(session.resources[1])
+
+    def test_timeout(self):
+        session = self.session({'get': '/delay/1', 'timeout': 0.1})
+        with self.assertRaises(restretto.errors.RequestTimeout):
+            session.test(session.resources[0])
+
+    def test_unknown_transport(self):
+        with self.assertRaises(ValueError):
+            restretto.transport.get_transport('carrier-pigeon')
+
+
+class Urllib3TransportTestCase(TransportTestCase):
+
+    transport = 'urllib3'
+
+
+@unittest.skipUnless(HAS_AIOHTTP, 'aiohttp is not installed')
+class AsyncioTransportTestCase(TransportTestCase):
+
+    transport = 'asyncio'
+
+
+class ControlTestCase(unittest.TestCase):
+
+    def test_max_failures(self):
+        control = restretto.control.Control(max_failures=2)
+        control.record('pass')
+        control.record('fail')
+        self.assertFalse(control.cancelled)
+        control.record('error')
+        self.assertTrue(control.cancelled)
+        self.assertIn('failures', control.reason)
+
+    def test_deadline(self):
+        control = restretto.control.Control(deadline=0)
+        self.assertTrue(control.cancelled)
+        self.assertEqual(control.reason, 'Deadline exceeded')
+        self.assertFalse(restretto.control.Control(deadline=60).cancelled)
+
+
+class HarTestCase(TempDirMixin, LocalServerMixin, unittest.TestCase):
+
+    def capture(self, session, **options):
+        path = self.temp_path('run.har')
+        har = restretto.har.HarWriter(path, **options)
+        restretto.runner.Runner(reporter=har).run([session])
+        har.close()
+        with open(path) as source:
+            return json.load(source)['log']
+
+    def test_entries(self):
+        session = self.session(
+            '/get?a=1', {'post': '/post', 'json': {'k': 'v'}}, {'wait': 0}, '/status/404',
+            {'get': '/delay/1', 'timeout': 0.05}
+        )
+        log = self.capture(session)
+        self.assertEqual(log['pages'][0]['title'], 'Local')
+        # wait step and failed request have no http exchange to save
+        self.assertEqual(len(log['entries']), 3)
+        (get, post, missing) = log['entries']
+        self.assertEqual(get['request']['queryString'], [{'name': 'a', 'value': '1'}])
+        self.assertEqual(json.loads(get['response']['content']['text'])['path'], '/get?a=1')
+        self.assertGreaterEqual(get['timings']['wait'], 0)
+        self.assertEqual(get['pageref'], 'page_1')
+        self.assertEqual(json.loads(post['request']['postData']['text']), {'k': 'v'})
+        self.assertEqual(missing['response']['status'], 404)
+        self.assertIn('fail', missing['comment'])
+
+    def test_truncated_bodies(self):
+        session = self.session('/bytes/1000', '/gzip/1000')
+        (plain, compressed) = self.capture(session, max_body=10)['entries']
+        self.assertEqual(plain['response']['content']['text'], 'a' * 10)
+        self.assertEqual(compressed['response']['content']['size'], 1000)
+        self.assertGreater(compressed['response']['content']['compression'], 0)
+        (plain, _) = self.capture(session, max_body=0)['entries']
+        self.assertNotIn('text', plain['response']['content'])
+
+    def test_unsupported_modes(self):
+        import contextlib
+        import io
+        for mode in (['--users', '2'], ['--coordinator', ':0'], ['--watch'], ['--probe', '1']):
+            with contextlib.redirect_stderr(io.StringIO()) as output:
+                with self.assertRaises(SystemExit):
+                    restretto.cli.main(['examples/01-basic.yml', '--har', 'out.har'] + mode)
+            self.assertIn('--har can not be used', output.getvalue())
+
+
+class DistributedTestCase(LocalServerMixin, unittest.TestCase):
+
+    def sessions(self, count):
+        return [
+            self.session('/get', {'get': '/status/500', 'title': 'broken'},
+                         title='S{}'.format(n), filename='s{}.yml'.format(n))
+            for n in range(count)
+        ]
+
+    def worker(self, address):
+        worker = restretto.distributed.Worker(address)
+        thread = threading.Thread(target=worker.run, daemon=True)
+        thread.start()
+        return thread
+
+    def test_thread_workers(self):
+        coordinator = restretto.distributed.Coordinator(self.sessions(5)).start()
+        workers = [self.worker(coordinator.address) for _ in range(3)]
+        totals = coordinator.wait()
+        coordinator.close()
+        self.assertEqual((totals['pass'], totals['fail'], totals.total), (5, 5, 10))
+        self.assertEqual(len(coordinator.durations), 5)
+        stats = coordinator.metrics.resources[('S3', 'broken')]
+        self.assertEqual(stats.outcomes['fail'], 1)
+        for thread in workers:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_process_workers(self):
+        coordinator = restretto.distributed.Coordinator(self.sessions(4)).start()
+        address = '{}:{}'.format(*coordinator.address)
+        workers = [
+            subprocess.Popen([sys.executable, '-m', 'restretto', '--worker', address])
+            for _ in range(2)
+        ]
+        totals = coordinator.wait()
+        coordinator.close()
+        for worker in workers:
+            self.assertEqual(worker.wait(10), 0)
+        self.assertEqual(totals.total, 8)
+        self.assertEqual(totals['pass'], 4)
+
+    def test_disconnected_worker(self):
+        coordinator = restretto.distributed.Coordinator(self.sessions(1)).start()
+        # worker taking task and disappearing
+        channel = restretto.distributed.Channel(socket.create_connection(coordinator.address))
+        channel.send('hello')
+        self.assertEqual(channel.receive()['type'], 'task')
+        channel.close()
+        self.worker(coordinator.address)
+        totals = coordinator.wait()
+        coordinator.close()
+        self.assertEqual((totals['pass'], totals['fail']), (1, 1))
+
+    def test_malformed_message(self):
+        coordinator = restretto.distributed.Coordinator(self.sessions(1)).start()
+        channel = restretto.distributed.Channel(socket.create_connection(coordinator.address))
+        channel.send('hello')
+        self.assertEqual(channel.receive()['type'], 'task')
+        # result without fields
+        channel.send('result')
+        self.assertIsNone(channel.receive())
+        channel.close()
+        self.worker(coordinator.address)
+        totals = coordinator.wait()
+        coordinator.close()
+        self.assertEqual((totals['pass'], totals['fail']), (1, 1))
+
+    def test_fail_fast(self):
+        control = restretto.control.Control(max_failures=1)
+        coordinator = restretto.distributed.Coordinator(self.sessions(3), control=control).start()
+        self.worker(coordinator.address)
+        totals = coordinator.wait()
+        coordinator.close()
+        self.assertEqual((totals['fail'], totals['cancelled']), (1, 4))
+
+    def test_cancel_running_task(self):
+        # no timeout nor deadline, blocked worker is stopped by coordinator
+        sessions = [self.session('/delay/10', filename='slow.yml'), self.session('/status/500', filename='failing.yml')]
+        control = restretto.control.Control(max_failures=1)
+        coordinator = restretto.distributed.Coordinator(sessions, control=control).start()
+        workers = [self.worker(coordinator.address) for _ in range(2)]
+        started = time.monotonic()
+        totals = coordinator.wait()
+        coordinator.close()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual((totals['fail'], totals['cancelled']), (1, 1))
+        for thread in workers:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+
+class FixturesTestCase(TempDirMixin, LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = self.temp_path('fixtures.json')
+
+    def suite(self, ttl=60):
+        login = self.session(
+            title='Login', filename='login.yml', headers={'X-Token': '{{token}}'},
+            setup={'ttl': ttl, 'resources': [{'get': '/login', 'vars': {'token': 'json.token'}}]},
+            teardown=[{'get': '/logout'}]
+        )
+        other = self.session(
+            {'get': '/get?t={{token}}', 'expect': [{'body': 'json', 'property': 'json.path', 'is': '/get?t=abc'}]},
+            headers={'X-Token': '{{token}}'}
+        )
+        return [login, other]
+
+    def setup(self, sessions, **kwargs):
+        runner = restretto.runner.Runner()
+        fixtures = restretto.fixtures.Fixtures(sessions, self.cache, **kwargs)
+        self.assertTrue(fixtures.setup(runner))
+        return (fixtures, runner)
+
+    def test_shared_vars(self):
+        sessions = self.suite()
+        (fixtures, runner) = self.setup(sessions)
+        self.assertEqual(fixtures.vars, {'token': 'abc'})
+        self.assertEqual(runner.totals['pass'], 1)
+        self.assertEqual(sessions[1].headers['X-Token'], 'abc')
+        self.assertEqual(sessions[1].http.headers['X-Token'], 'abc')
+        self.assertTrue(runner.run(sessions).ok)
+        self.assertEqual(runner.totals['pass'], 2)
+        self.assertEqual(os.stat(self.cache).st_mode & 0o777, 0o600)
+
+    def test_cached_vars(self):
+        self.setup(self.suite())
+        (fixtures, runner) = self.setup(self.suite())
+        # setup is skipped within ttl
+        self.assertEqual(runner.totals.total, 0)
+        self.assertEqual(fixtures.vars, {'token': 'abc'})
+        (fixtures, runner) = self.setup(self.suite(), refresh=True)
+        self.assertEqual(runner.totals.total, 1)
+
+    def test_expired_vars(self):
+        self.setup(self.suite(ttl=0.01))
+        time.sleep(0.02)
+        (fixtures, runner) = self.setup(self.suite(ttl=0.01))
+        self.assertEqual(runner.totals.total, 1)
+
+    def test_failed_setup(self):
+        session = self.session('/get', setup=[{'get': '/status/401'}])
+        runner = restretto.runner.Runner()
+        fixtures = restretto.fixtures.Fixtures([session], self.cache)
+        self.assertFalse(fixtures.setup(runner))
+        self.assertEqual(runner.control.reason, 'Suite setup failed: get /status/401: Bad response (401 Unauthorized)')
+        runner.run([session])
+        self.assertEqual(runner.totals['cancelled'], 1)
+        self.assertFalse(os.path.exists(self.cache))
+
+    def test_failed_setup_fail_fast(self):
+        session = self.session('/get', setup=[{'get': '/status/401'}])
+        runner = restretto.runner.Runner(control=restretto.control.Control(max_failures=1))
+        fixtures = restretto.fixtures.Fixtures([session], self.cache)
+        self.assertFalse(fixtures.setup(runner))
+        self.assertTrue(runner.control.reason.startswith('Suite setup failed: get /status/401'))
+        self.assertEqual(runner.totals['fail'], 1)
+
+    def test_failed_setup_summary(self):
+        import contextlib
+        import io
+        self.write('login.yml', 'title: Login\nbaseUri: {}\nsetup:\n  - /status/401\nresources:\n  - /get\n'.format(
+            self.base_uri
+        ))
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            code = restretto.cli.main([
+                self.directory, '--fail-fast', '--fixtures-cache', self.cache,
+                '--results', self.temp_path('results.json')
+            ])
+        self.assertEqual(code, 1)
+        self.assertIn('Total: 2 / Passed: 0 / Errors: 0 / Failed: 1 / Cancelled: 1', output.getvalue())
+        self.assertIn('Run cancelled: Suite setup failed: get /status/401', output.getvalue())
+
+    def test_teardown_after_failed_setup(self):
+        failed = self.session(setup=[{'get': '/status/401'}], teardown=['/logout'])
+        cleanup = self.session('/get', teardown=['/cleanup'])
+        fixtures = restretto.fixtures.Fixtures([failed, cleanup], self.cache)
+        self.assertFalse(fixtures.setup(restretto.runner.Runner()))
+        results = fixtures.teardown(restretto.runner.Runner())
+        self.assertEqual([r.resource for r in results], ['get /cleanup'])
+
+    def test_teardown_deadline(self):
+        sessions = self.suite()
+        (fixtures, _) = self.setup(sessions)
+        control = restretto.control.Control(deadline=0)
+        results = fixtures.teardown(restretto.runner.Runner(control=restretto.control.Control(control.remaining)))
+        self.assertEqual([r.outcome for r in results], ['cancelled'])
+
+    def test_teardown(self):
+        sessions = self.suite()
+        (fixtures, _) = self.setup(sessions)
+        results = fixtures.teardown(restretto.runner.Runner())
+        self.assertEqual([r.session for r in results], ['Login (teardown)'])
+        self.assertEqual(results[0].outcome, 'pass')
+
+
+class HttpCacheTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_revalidation(self):
+        session = self.session({'get': '/etag/v1', 'expect': [{'cached': False}]}, cache=True)
+        runner = restretto.runner.Runner()
+        runner.run([session])
+        self.assertEqual(runner.totals['pass'], 1)
+        session.resources[0].asserts = [
+            {'status': 304}, {'cached': True}, {'body': 'json', 'property': 'json.token', 'is': 'abc'}
+        ]
+        runner.run([session])
+        self.assertEqual(runner.totals['pass'], 2)
+        response = session.resources[0].response
+        self.assertEqual(response.request.headers['If-None-Match'], '"v1"')
+        self.assertEqual(response.saved, response.body_size)
+        self.assertEqual((runner.totals.cached, runner.totals.saved), (1, response.saved))
+
+    def test_fresh_response(self):
+        session = self.session({'get': '/cache/60'}, {'get': '/cache/60', 'expect': [{'cached': True}]}, cache=True)
+        self.assertTrue(restretto.runner.Runner().run([session]).ok)
+        response = session.resources[1].response
+        self.assertIsNone(response.request)
+        self.assertEqual(response.transfer_size, 0)
+        self.assertGreater(response.saved, 0)
+
+    def test_not_cacheable(self):
+        session = self.session(
+            '/get', {'get': '/get', 'expect': [{'cached': False}]},
+            {'get': '/etag/v1', 'headers': {'Cache-Control': 'no-store'}},
+            {'get': '/etag/v1', 'expect': [{'status': 200}, {'cached': False}]}, cache=True
+        )
+        self.assertTrue(restretto.runner.Runner().run([session]).ok)
+
+    def test_disabled(self):
+        session = self.session('/cache/60', {'get': '/cache/60', 'expect': [{'cached': True}]})
+        totals = restretto.runner.Runner().run([session])
+        self.assertEqual(totals['fail'], 1)
+
+
+class Urllib3HttpCacheTestCase(HttpCacheTestCase):
+
+    transport = 'urllib3'
+
+
+class CheckTestCase(unittest.TestCase):
+
+    def problems(self, path, context=None):
+        import restretto.check
+        return [
+            '{}: {}'.format(p.location.split(' ')[0], p.message)
+            for p in restretto.check.check(path, context)
+        ]
+
+    def test_examples(self):
+        self.assertEqual(self.problems('examples', {'thing': 'restretto', 'message': 'hi'}), [])
+        self.assertEqual(self.problems('examples/dweetio.yml', {'thing': 'restretto'}), [
+            'resources[1]: Undefined variable: message'
+        ])
+
+    def test_problems(self):
+        problems = self.problems('test-data/check/problems.yml', {'version': 1})
+        self.assertEqual(problems, [
+            'session: Undefined variable: host',
+            'resources[1]: Var broken path should start with json or headers',
+            'resources[3]: Unknown http method verb: fetch',
+            'resources[4]: Unknown resource key: expects',
+            "resources[4]: Bad template '{{ broken_template }': unexpected '}'",
+            'resources[4]: Undefined variable: itme',
+            'resources[4]: Unknown operator: equal',
+            'resources[4]: Unknown assertion: headers',
+            'resources[4]: Unknown size: wire (should be one of body, transfer)',
+            'resources[4]: Bad size value: 1 parsec',
+            'resources[4]: Schema file not found: test-data/schemas/missing.json',
+        ])
+
+    def test_cli(self):
+        import contextlib
+        import io
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(restretto.cli.main(['examples/01-basic.yml', '--check']), 0)
+            self.assertEqual(restretto.cli.main(['test-data/check', '--check']), 1)
+        self.assertIn('Checked files: 1 / Problems: 12', output.getvalue())
+
+
+class UsersTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_fork(self):
+        session = self.session('/set-cookie', {'get': '/get', 'vars': {'cookie': 'json.cookie'}})
+        one = session.fork()
+        other = session.fork()
+        self.addCleanup(one.close)
+        self.addCleanup(other.close)
+        restretto.runner.Runner().run([one])
+        restretto.runner.Runner().run_resources(other, other.resources[1:])
+        self.assertEqual(one.context['cookie'], 'sid=s3cr3t')
+        self.assertIsNone(other.context['cookie'])
+        self.assertNotIn('cookie', session.context)
+        self.assertIsNone(session.resources[1].response)
+        self.assertIs(one.http.session.adapters, session.http.session.adapters)
+        replaced = session.http.session.get_adapter(self.base_uri)
+        session.http.set_pool_size(5)
+        self.assertEqual(len(replaced.poolmanager.pools), 0)
+        self.assertIsNot(one.http.session.get_adapter(self.base_uri), replaced)
+
+    def test_users(self):
+        session = self.session('/set-cookie', '/get', title='Scenario')
+        users = restretto.users.VirtualUsers([session], 5, ramp_up=0.1, think_time=(0.01, 0.02))
+        totals = users.run()
+        self.assertEqual((totals['pass'], totals.total), (10, 10))
+        self.assertEqual(users.started, 5)
+        self.assertGreaterEqual(users.duration, 0.08)
+        self.assertEqual(users.metrics.resources[('Scenario', 'get /get')].latency.count, 5)
+        # forks are aborted through their base session, not kept alive by hooks
+        self.assertEqual(len(users.control._hooks), 1)
+
+    def test_cancelled(self):
+        session = self.session('/status/500', '/get')
+        control = restretto.control.Control(max_failures=1)
+        users = restretto.users.VirtualUsers([session], 20, ramp_up=1, control=control)
+        started = time.monotonic()
+        totals = users.run()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertLess(users.started, 20)
+        self.assertEqual(totals['fail'], 1)
+
+    def test_cancel_in_flight(self):
+        # no timeout nor deadline, blocked user is woken up by failure of other one
+        control = restretto.control.Control(max_failures=1)
+        blocked = restretto.users.VirtualUsers([self.session('/delay/10')], 1, control=control)
+        thread = threading.Thread(target=blocked.run)
+        started = time.monotonic()
+        thread.start()
+        time.sleep(0.3)
+        failing = restretto.users.VirtualUsers([self.session('/status/500', {'wait': 10})], 1, control=control)
+        self.assertEqual(failing.run()['fail'], 1)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(blocked.totals['cancelled'], 1)
+
+    def test_cancel_wait(self):
+        control = restretto.control.Control()
+        session = self.session({'wait': 10})
+        threading.Timer(0.1, control.cancel, ('Stop',)).start()
+        started = time.monotonic()
+        result = restretto.runner.Runner(control=control).run_resources(session, session.resources)[0]
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual((result.outcome, result.message), ('cancelled', 'Stop'))
+
+
+@unittest.skipUnless(HAS_AIOHTTP, 'aiohttp is not installed')
+class AsyncioUsersTestCase(UsersTestCase):
+
+    transport = 'asyncio'
+
+    def test_fork(self):
+        session = self.session('/get')
+        forked = session.fork()
+        self.assertIs(forked.http.client.connector, session.http.client.connector)
+        forked.close()
+        self.assertIsNotNone(session.test(session.resources[0]).response)
+
+
+class Urllib3UsersTestCase(UsersTestCase):
+
+    transport = 'urllib3'
+
+    def test_fork(self):
+        session = self.session('/get')
+        forked = session.fork()
+        self.assertIs(forked.http.pool, session.http.pool)
+        forked.close()
+        self.assertIsNotNone(session.test(session.resources[0]).response)
+
+
+class HistoryTestCase(TempDirMixin, LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = self.temp_path('history.db')
+
+    def history(self):
+        history = restretto.history.History(self.path)
+        self.addCleanup(history.close)
+        return history
+
+    def record(self, history, *timings):
+        for elapsed in timings:
+            run = history.start_run()
+            history.add(run, [
+                ('a.yml', 'get /', 'pass', elapsed),
+                ('a.yml', 'get /other', 'pass', 0.1),
+                ('a.yml', 'get /other', 'error', None),
+            ])
+
+    def test_percentile(self):
+        self.assertEqual(restretto.history.percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(restretto.history.percentile([3, 1, 2], 95), 3)
+        self.assertIsNone(restretto.history.percentile([], 95))
+        self.assertEqual(restretto.history.sparkline([1, None, 2, 1.5]), '▁ █▄')
+
+    def test_regression(self):
+        history = self.history()
+        self.record(history, 0.1, 0.1, 0.12, 0.1, 0.11, 0.2)
+        trends = {t.resource: t for t in restretto.history.trends(history, window=1, baseline=5)}
+        self.assertTrue(trends['get /'].regression)
+        self.assertAlmostEqual(trends['get /'].baseline, 0.12)
+        self.assertAlmostEqual(trends['get /'].change, 0.2 / 0.12 - 1)
+        self.assertFalse(trends['get /other'].regression)
+        self.assertEqual(len(trends['get /'].per_run), 6)
+        # baseline window does not reach the oldest runs
+        trends = restretto.history.trends(history, window=1, baseline=1, threshold=1)
+        self.assertFalse(any(t.regression for t in trends))
+
+    def test_reporter(self):
+        session = self.session('/get', '/status/500', filename='./local.yml')
+        history = self.history()
+        reporter = restretto.history.HistoryReporter(history, 'local.yml')
+        restretto.runner.Runner(reporter=reporter).run([session])
+        reporter.close()
+        timings = history.timings(history.runs())
+        self.assertEqual(sorted(timings), [('local.yml', 'get /get'), ('local.yml', 'get /status/500')])
+
+    def test_report(self):
+        import contextlib
+        import io
+        self.record(self.history(), 0.1, 0.1, 0.1, 0.3)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(restretto.cli.main(['report', '--history', self.path]), 1)
+            self.assertEqual(restretto.cli.main(['report', '--history', self.path, '--threshold', '300']), 0)
+            self.assertEqual(restretto.cli.main(['report', '--history', self.path, '--min-baseline', '4']), 0)
+        self.assertIn('+200.0%', output.getvalue())
+        self.assertIn('Runs: 4 / Resources: 2 / Regressions: 0', output.getvalue())
+
+    def test_min_baseline(self):
+        history = self.history()
+        self.record(history, 0.1, 0.3)
+        self.assertFalse(any(t.regression for t in restretto.history.trends(history)))
+        self.assertTrue(any(t.regression for t in restretto.history.trends(history, min_baseline=1)))
+
+    def test_default_history(self):
+        arguments = restretto.cli.parser.parse_args(['--history', 'tests'])
+        self.assertEqual((arguments.path, arguments.history, arguments.history_file), ('tests', True, None))
+        arguments = restretto.cli.parser.parse_args(['--history-file', self.path, 'tests'])
+        self.assertEqual((arguments.path, arguments.history_file), ('tests', self.path))
+        self.assertEqual(restretto.cli.report_parser.parse_args([]).history, restretto.history.DEFAULT_HISTORY)
+
+
+class SnapshotTestCase(TempDirMixin, LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = restretto.snapshot.DIRECTORY
+        restretto.snapshot.DIRECTORY = self.temp_path('snapshots')
+        self.addCleanup(setattr, restretto.snapshot, 'DIRECTORY', directory)
+        self.addCleanup(setattr, restretto.snapshot, 'UPDATE', False)
+
+    def run_snapshot(self, url, name='golden', **options):
+        options['snapshot'] = name
+        session = self.session({'get': url, 'expect': [options]})
+        return restretto.runner.Runner().run_resources(session, session.resources)[0]
+
+    def test_encode(self):
+        data = {'b': [{'x': 1, 'at': 't1'}, {'x': 2, 'at': 't2'}], 'a': 'é'}
+        patterns = restretto.snapshot.parse_patterns(['json.b.*.at'])
+        text = ''.join(restretto.snapshot.encode(data, patterns))
+        self.assertEqual(json.loads(text), {'a': 'é', 'b': [{'x': 1}, {'x': 2}]})
+        self.assertTrue(text.startswith('{\n  "a": "é",\n'))
+
+    def test_record_and_compare(self):
+        result = self.run_snapshot('/get?v=1')
+        self.assertEqual(result.outcome, 'fail')
+        self.assertIn('Snapshot not recorded', result.message)
+        restretto.snapshot.UPDATE = True
+        self.assertEqual(self.run_snapshot('/get?v=1').outcome, 'pass')
+        restretto.snapshot.UPDATE = False
+        self.assertEqual(self.run_snapshot('/get?v=1').outcome, 'pass')
+        path = restretto.snapshot.snapshot_path('golden')
+        (digest, kind) = restretto.snapshot.read_digest(path)
+        self.assertEqual(kind, 'json')
+        self.assertEqual(json.loads(restretto.snapshot.read_body(path))['path'], '/get?v=1')
+        result = self.run_snapshot('/get?v=2')
+        self.assertEqual(result.outcome, 'fail')
+        self.assertEqual(result.message, 'Snapshot mismatch (golden): json.path: "/get?v=2" != "/get?v=1"')
+        self.assertEqual(restretto.snapshot.read_digest(path)[0], digest)
+
+    def test_ignore(self):
+        restretto.snapshot.UPDATE = True
+        self.run_snapshot('/get?v=1', ignore=['json.path'])
+        restretto.snapshot.UPDATE = False
+        self.assertEqual(self.run_snapshot('/get?v=2', ignore=['json.path']).outcome, 'pass')
+        self.assertEqual(self.run_snapshot('/get?v=2').outcome, 'fail')
+
+    def test_text(self):
+        restretto.snapshot.UPDATE = True
+        self.run_snapshot('/bytes/3', 'text')
+        restretto.snapshot.UPDATE = False
+        result = self.run_snapshot('/bytes/4', 'text')
+        self.assertEqual(result.message, 'Snapshot mismatch (text): @@ -1 +1 @@; -aaa; +aaaa')
+        result = self.run_snapshot('/get', 'text')
+        self.assertEqual(result.message, 'Snapshot mismatch (text): text body recorded, json received')
+
+    def test_worker_options(self):
+        directory = self.temp_path('worker')
+        session = self.session({'get': '/get?v=1', 'expect': [{'snapshot': 'golden'}]})
+        for options in (['--update-snapshots'], []):
+            coordinator = restretto.distributed.Coordinator([session]).start()
+            worker = subprocess.Popen([
+                sys.executable, '-m', 'restretto', '--worker', '{}:{}'.format(*coordinator.address),
+                '--snapshots', directory
+            ] + options)
+            totals = coordinator.wait()
+            coordinator.close()
+            self.assertEqual(worker.wait(10), 0)
+            self.assertEqual(totals['pass'], 1)
+        self.assertTrue(os.path.exists(restretto.snapshot.snapshot_path('golden', directory)))
+
+    def test_check(self):
+        import restretto.check
+        self.assertEqual(restretto.check.check_assertion({'snapshot': 'missing', 'ignor': []}), [
+            'Unknown snapshot option: ignor',
+            'Snapshot not recorded: {}'.format(restretto.snapshot.snapshot_path('missing'))
+        ])
+
+
+class WatchTestCase(TempDirMixin, LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('vars.yml', 'path: /get\n')
+        self.write('users.yml', 'title: Users\nvars: vars.yml\nbaseUri: {}\nresources:\n  - url: "{{{{path}}}}"\n'.format(
+            self.base_uri
+        ))
+        self.write('other.yml', 'title: Other\nbaseUri: {}\nresources:\n  - /get\n'.format(self.base_uri))
+        self.watch = restretto.watch.Watch(self.directory)
+        self.addCleanup(self.watch.close)
+
+    def titles(self, sessions):
+        return sorted(session.title for session in sessions)
+
+    def test_load(self):
+        sessions = self.watch.load()
+        self.assertEqual(self.titles(sessions), ['Other', 'Users'])
+        self.assertEqual(self.watch.dependants, {
+            os.path.join(self.directory, 'vars.yml'): {os.path.join(self.directory, 'users.yml')}
+        })
+        self.assertTrue(restretto.runner.Runner().run(sessions).ok)
+        # sessions fork transport owned by watch
+        self.assertEqual(len(self.watch.pools), 1)
+
+    def test_reload(self):
+        self.watch.load()
+        self.assertIsNone(self.watch.reload([os.path.join(self.directory, 'notes.txt')]))
+        changed = self.write('vars.yml', 'path: /status/404\n')
+        sessions = self.watch.reload([changed])
+        self.assertEqual(self.titles(sessions), ['Users'])
+        self.assertEqual(sessions[0].context['path'], '/status/404')
+        changed = self.write('other.yml', 'title: Other\nresources: [')
+        self.assertEqual(self.watch.reload([changed]), [])
+        self.assertIn(os.path.abspath(changed), self.watch.errors)
+        os.remove(changed)
+        self.assertEqual(self.watch.reload([changed]), [])
+        self.assertEqual(self.watch.errors, {})
+        self.assertEqual(self.titles(self.watch.sessions.values()), ['Users'])
+
+    def test_polling(self):
+        self.watch.load()
+        watcher = restretto.watch.PollingWatcher(self.watch.files, interval=0.01)
+        self.assertEqual(watcher.wait(0.02), set())
+        # mtime resolution of some filesystems is coarse, size changes too
+        path = self.write('vars.yml', 'path: /get?changed\n')
+        self.assertEqual(watcher.wait(1), {path})
+        path = self.write('new.yml', 'resources: [/get]\n')
+        self.assertEqual(watcher.wait(1), {path})
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+    def test_inotify(self):
+        self.watch.load()
+        watcher = restretto.watch.InotifyWatcher(self.watch.files, [self.directory])
+        self.addCleanup(watcher.close)
+        self.assertEqual(watcher.wait(0.02), set())
+        path = self.write('vars.yml', 'path: /get?changed\n')
+        self.assertEqual(watcher.wait(1), {path})
+        os.mkdir(os.path.join(self.directory, 'sub'))
+        # new directory gets watched, while it has no test files yet
+        self.assertEqual(watcher.wait(0.2), set())
+        path = self.write(os.path.join('sub', 'new.yml'), 'resources: [/get]\n')
+        self.assertEqual(watcher.wait(1), {path})
+        self.assertEqual(self.titles(self.watch.reload({path})), [''])
+
+    def test_teardown_on_exit(self):
+        import contextlib
+        import io
+
+        class Interrupted(object):
+            name = 'interrupted'
+
+            def __init__(self, files, roots=()):
+                pass
+
+            def wait(self, timeout=None):
+                raise KeyboardInterrupt
+
+            def close(self):
+                pass
+
+        self.write('login.yml', 'title: Login\nbaseUri: {}\nsetup:\n  - /login\nteardown:\n  - /logout\n'.format(
+            self.base_uri
+        ))
+        watcher = restretto.watch.watcher
+        restretto.watch.watcher = Interrupted
+        self.addCleanup(setattr, restretto.watch, 'watcher', watcher)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            code = restretto.cli.main([
+                self.directory, '--watch', '--print-passed', '--fixtures-cache', self.temp_path('fixtures.json')
+            ])
+        self.assertEqual(code, 0)
+        self.assertIn('Test session: Login (setup)', output.getvalue())
+        self.assertIn('Test session: Login (teardown)', output.getvalue())
+
+
+class LastRunTestCase(TempDirMixin, LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.results = self.temp_path('results.json')
+        self.write('vars.yml', 'path: /get\n')
+        self.write('a.yml', 'title: A\nvars: vars.yml\nresources:\n  - url: "{{path}}"\n')
+        self.write('b.yml', 'title: B\nresources:\n  - /status/500\n')
+        self.write('c.yml', 'title: C\nresources:\n  - /get\n')
+
+    def load(self):
+        sessions = []
+        for name in ('a.yml', 'b.yml', 'c.yml'):
+            spec = restretto.loader.load_spec(os.path.join(self.directory, name))
+            spec['baseUri'] = self.base_uri
+            sessions.append(restretto.Session(spec))
+            self.addCleanup(sessions[-1].close)
+        return sessions
+
+    def run_sessions(self, sessions):
+        digests = restretto.lastrun.digests(sessions)
+        reporter = restretto.lastrun.ResultsReporter(self.results, digests)
+        restretto.runner.Runner(reporter=reporter).run(sessions)
+        reporter.close()
+
+    def select(self, **options):
+        sessions = self.load()
+        digests = restretto.lastrun.digests(sessions)
+        results = restretto.lastrun.load_results(self.results)
+        return [s.title for s in restretto.lastrun.select(sessions, results, digests, **options)]
+
+    def test_last_failed(self):
+        self.assertEqual(self.select(last_failed=True), ['A', 'B', 'C'])
+        self.run_sessions(self.load())
+        self.assertEqual(self.select(last_failed=True), ['B'])
+        self.assertEqual(self.select(failed_first=True), ['B', 'A', 'C'])
+        self.write('b.yml', 'title: B\nresources:\n  - /get\n')
+        self.run_sessions([s for s in self.load() if s.title == 'B'])
+        # no failures left, whole suite is run again
+        self.assertEqual(self.select(last_failed=True), ['A', 'B', 'C'])
+
+    def test_changed_only(self):
+        self.assertEqual(self.select(changed_only=True), ['A', 'B', 'C'])
+        self.run_sessions(self.load())
+        self.assertEqual(self.select(changed_only=True), [])
+        self.write('vars.yml', 'path: /get?v=2\n')
+        self.assertEqual(self.select(changed_only=True), ['A'])
+        self.assertEqual(self.select(changed_only=True, last_failed=True), ['A', 'B'])
+
+    def main(self, *args, timings='timings.json'):
+        """Run cli on test directory, returns exit code and titles of sessions run"""
+        import contextlib
+        import io
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            code = restretto.cli.main([
+                self.directory, '--results', self.results, '--timings', self.temp_path(timings),
+                '--fixtures-cache', self.temp_path('fixtures.json')
+            ] + list(args))
+        titles = [
+            line.split(': ', 1)[1] for line in output.getvalue().splitlines()
+            if line.startswith('Test session: ') and not line.endswith('(setup)')
+        ]
+        return (code, titles)
+
+    def test_main(self):
+        base = 'baseUri: {}\n'.format(self.base_uri)
+        self.write('a.yml', 'title: A\n' + base + 'vars: vars.yml\n'
+                   'setup:\n  - get: /login\n    vars:\n      token: json.token\n'
+                   'resources:\n  - url: "{{path}}"\n')
+        self.write('b.yml', 'title: B\n' + base + 'resources:\n  - /status/500\n')
+        # passes only with token extracted by setup of A, whichever shard it runs in
+        self.write('c.yml', 'title: C\n' + base + 'resources:\n  - get: "/get?t={{token}}"\n'
+                   '    expect:\n      - body: json\n        property: json.path\n        is: /get?t=abc\n')
+        (code, titles) = self.main()
+        self.assertEqual((code, sorted(titles)), (1, ['A', 'B', 'C']))
+        timings = restretto.shard.load_timings(self.temp_path('timings.json'))
+        self.assertEqual(sorted(os.path.basename(k) for k in timings), ['a.yml', 'b.yml', 'c.yml'])
+        # shards run as parallel jobs, every one with timings of the last full run
+        for index in (1, 2):
+            shutil.copy(self.temp_path('timings.json'), self.temp_path('timings-{}.json'.format(index)))
+        os.remove(self.results)
+        shards = [
+            self.main('--shard', '{}/2'.format(index), timings='timings-{}.json'.format(index))
+            for index in (1, 2)
+        ]
+        self.assertTrue(all(titles for (_, titles) in shards))
+        self.assertEqual(sorted(sum((titles for (_, titles) in shards), [])), ['A', 'B', 'C'])
+        self.assertEqual(sorted(code for (code, _) in shards), [0, 1])
+        results = restretto.lastrun.load_results(self.results)
+        self.assertEqual({os.path.basename(k): v['failed'] for (k, v) in results.items()}, {
+            'a.yml': False, 'b.yml': True, 'c.yml': False
+        })
+        self.assertEqual(self.main('--last-failed'), (1, ['B']))
+        self.assertEqual(
+            sorted(self.main('--last-failed', '--shard', '{}/2'.format(index)) for index in (1, 2)),
+            [(0, []), (1, ['B'])]
+        )
+        self.write('b.yml', 'title: B\n' + base + 'resources:\n  - /get\n')
+        self.assertEqual(self.main('--last-failed'), (0, ['B']))
+        (code, titles) = self.main('--last-failed')
+        self.assertEqual((code, sorted(titles)), (0, ['A', 'B', 'C']))
+
+    def test_cancelled(self):
+        sessions = self.load()
+        control = restretto.control.Control()
+        control.cancel('Stop')
+        reporter = restretto.lastrun.ResultsReporter(self.results, restretto.lastrun.digests(sessions))
+        restretto.runner.Runner(control=control, reporter=reporter).run(sessions)
+        reporter.close()
+        self.assertFalse(os.path.exists(self.results))
+
+
+class StartupTestCase(unittest.TestCase):
+
+    # cumulative import time of restretto.cli, microseconds
+    IMPORT_BUDGET = 60000
+    # should not be imported unless sessions are really loaded or run
+    HEAVY_MODULES = ('requests', 'urllib3', 'aiohttp', 'yaml', 'jinja2', 'clint', 'jsonschema')
+
+    def python(self, *args):
+        return subprocess.run(
+            (sys.executable,) + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+
+    def test_import_budget(self):
+        result = self.python('-X', 'importtime', '-c', 'import restretto.cli')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        line = [l for l in result.stderr.splitlines() if l.endswith('| restretto.cli')][0]
+        cumulative = int(line.split('|')[1])
+        self.assertLess(cumulative, self.IMPORT_BUDGET)
+
+    def test_lazy_imports(self):
+        result = self.python('-c', 'import sys, restretto, restretto.cli; '
+                             'restretto.cli.parser.parse_args(["path"]); '
+                             'print(" ".join(sorted(m for m in sys.modules if m.split(".")[0] in {})))'
+                             .format(self.HEAVY_MODULES))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_version(self):
+        result = self.python('-m', 'restretto', '--version')
+        self.assertEqual(result.returncode, 0)
+        self.assertIn(restretto.__version__, result.stdout)
+
+    def test_lazy_attributes(self):
+        self.assertIs(restretto.Session, restretto.rest.Session)
+        with self.assertRaises(AttributeError):
+            restretto.missing
+
+
 if __name__ == "__main__":
     unittest.main()